@@ -1,21 +1,39 @@
-from math import sin, asin, sqrt, pi
+from numpy import sin, arcsin, sqrt, hypot, floor, pi, asarray, searchsorted
+
+# all the functions accept python scalars or numpy arrays,
+# arrays are broadcast against each other, e.g.
+#     in_tree_pixel(baf_array[:, None], img_width_array[None, :])
 
 
 def in_tree_pixel(baf, img_width):
     # baf is the Basal Area factor
-    # tree_width is the app measured tree pixel width
+    # img_width is the panorama image pixel width
+    # return the minimum tree pixel width to be an "in" tree
 
-    theta = 2 * asin(sqrt(baf) / 100)  # radians
-    min_tree_width = theta / (2*pi) * img_width  # also use rad(360) = 2 pi
+    theta = 2 * arcsin(sqrt(baf) / 100)  # radians
+    min_tree_width = theta / (2*pi) * asarray(img_width)  # also use rad(360) = 2 pi
 
     return min_tree_width
 
 
 def max_baf(img_width, tree_width):
 
-    return (100 * sin((pi * tree_width) / img_width)) ** 2
+    return (100 * sin((pi * asarray(tree_width)) / img_width)) ** 2
+
+
+def tree_width_pixel(lx, ly, rx, ry):
+    # the app measured tree pixel width (truncated to int) between left and right edge points
+
+    return floor(hypot(asarray(lx) - rx, asarray(ly) - ry)).astype(int)
+
+
+def in_tree_count(sorted_max_baf, baf):
+    # number of trees whose max_baf >= baf, sorted_max_baf must be in ascending order
+    # baf can be an array to count a whole BAF sequence by binary search
+
+    return len(sorted_max_baf) - searchsorted(sorted_max_baf, baf, side='left')
+
 
-    
 def plot_ba_calculator(baf, in_tree_num):
 
-    return baf * in_tree_num
\ No newline at end of file
+    return asarray(baf) * in_tree_num
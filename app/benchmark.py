@@ -0,0 +1,113 @@
+# -*- coding:utf-8 -*-
+"""
+Performance benchmarks of Panorama2BA, run by
+    python benchmark.py
+"""
+import os
+import time
+import tempfile
+import random
+import numpy as np
+from PIL import Image
+from PIL.ImageOps import equalize
+from db import DataBase
+from imgproc import preprocess_image, enhance_methods
+
+
+def _fill_project(db, img_num, trees_per_img, img_id_start=0):
+    # images with random trees, ids continue from img_id_start
+    img_rows = []
+    tree_rows = []
+    for img_id in range(img_id_start, img_id_start + img_num):
+        img_rows.append((img_id, '', str(img_id), 5376, 2688, 2, 0))
+        for i in range(trees_per_img):
+            tree_id = img_id * trees_per_img + i
+            tree_rows.append((tree_id, img_id, 0, 0, 1, 1, random.random() * 20))
+    db.curs.executemany('insert into ImageInfo (img_id, img_dir, img_name, width, height, default_baf, mode) '
+                        'values (?,?,?,?,?,?,?)', img_rows)
+    db.curs.executemany('insert into TreeInfo values (?,?,?,?,?,?,?)', tree_rows)
+    db.commit()
+
+
+def _time_lookup(db, img_num, repeat=200):
+    st = time.perf_counter()
+    for i in range(repeat):
+        img_id = random.randrange(img_num)
+        db.get_tree_info(img_id)
+        db.get_click_info(img_id)
+    return (time.perf_counter() - st) / repeat * 1000  # ms
+
+
+def bench_index(trees_per_img=50):
+    # per image lookup should keep flat when project grows to 10^5 trees
+    print('== per image lookup (get_tree_info + get_click_info), {} trees per image =='.format(trees_per_img))
+    print('{:>10} {:>14} {:>14}'.format('trees', 'index(ms)', 'no index(ms)'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db = DataBase(os.path.join(tmp_dir, 'bench.sqlite'))
+        try:
+            _bench_index(db, trees_per_img)
+        finally:
+            db.conn.close()
+
+
+def _bench_index(db, trees_per_img):
+    img_num = 0
+    for tree_num in [10 ** 3, 10 ** 4, 10 ** 5]:
+        new_img_num = tree_num // trees_per_img - img_num
+        _fill_project(db, new_img_num, trees_per_img, img_id_start=img_num)
+        img_num += new_img_num
+
+        indexed = _time_lookup(db, img_num)
+        db.curs.execute('DROP INDEX TreeInfo_img_baf')
+        db.curs.execute('DROP INDEX ClickInfo_img_baf')
+        no_index = _time_lookup(db, img_num)
+        db.create_index()
+
+        print('{:>10} {:>14.3f} {:>14.3f}'.format(tree_num, indexed, no_index))
+
+
+def _time_it(func, repeat=3):
+    st = time.perf_counter()
+    for i in range(repeat):
+        func()
+    return (time.perf_counter() - st) / repeat * 1000  # ms
+
+
+def bench_enhance(size=(5376, 2688)):
+    # preprocess_image() steps of each enhance method on a panorama sized image,
+    # 'saved lut' is reopening an image with the lookup table saved in the project
+    print('== image enhancement, {}x{} =='.format(*size))
+    # the test image only lives in a temporary folder, removed with it even if a step fails
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        _bench_enhance(os.path.join(tmp_dir, 'bench.jpg'), size)
+
+
+def _bench_enhance(img_path, size):
+    # smooth gradients + noise, closer to photos than pure noise
+    x = np.linspace(0, 1, size[0])[None, :, None]
+    y = np.linspace(0, 1, size[1])[:, None, None]
+    pixels = 60 + 80 * x * y + 40 * np.sin(x * 20) + np.random.normal(0, 10, (size[1], size[0], 3))
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(img_path, quality=90)
+
+    image = Image.open(img_path).convert('RGB')
+    print('{:>12} {:>10}'.format('PIL equalize', '{:.1f}ms'.format(_time_it(lambda: equalize(image)))))
+    print('{:>12} {:>10} {:>10} {:>10} {:>10}'.format('method', 'decode', 'lut', 'apply', 'total'))
+    for enhance in enhance_methods + ['saved lut']:
+        if enhance == 'saved lut':
+            options = {'enhance': 'equalize', 'lut': preprocess_image(img_path)['lut']}
+        else:
+            options = {'enhance': enhance}
+        timings = [preprocess_image(img_path, **options)['timings'] for i in range(3)]
+        mean = {k: sum(t[k] for t in timings) / len(timings) * 1000 for k in timings[0]}
+        print('{:>12} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms'.format(
+            enhance, mean['decode'], mean['lut'], mean['apply'], sum(mean.values())))
+
+    # the subsampled histogram gives nearly the same equalized image as PIL
+    diff = np.abs(np.asarray(preprocess_image(img_path)['image'], dtype=int) -
+                  np.asarray(equalize(image), dtype=int))
+    print('mean abs difference to PIL equalize: {:.2f} (of 255)'.format(diff.mean()))
+
+
+if __name__ == '__main__':
+    bench_index()
+    bench_enhance()
@@ -1,55 +1,102 @@
 import os
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from math import sqrt
+from numpy import array, asarray, unique, split, empty, broadcast_to, arange
 from PIL import Image
-from ba import plot_ba_calculator, max_baf, in_tree_pixel
+from ba import plot_ba_calculator, max_baf, in_tree_pixel, tree_width_pixel, in_tree_count
+from store import ColumnStore, TreeStore, IN_TREE, img_columns, tree_columns, click_columns, tree_all_columns, \
+    click_all_columns
 
 
 class DataBase:
 
     db_path = 'test.sqlite'
 
-    def __init__(self, db_path='test.sqlite'):
-        if not os.path.exists(db_path):
-            self.create_db(db_path)
-        else:  # open a table
-            self.conn = sqlite3.connect(db_path)
-            self.curs = self.conn.cursor()
-
-    def create_db(self, db_path):
-        self.conn = sqlite3.connect(db_path)
-        self.curs = self.conn.cursor()
-
-        self.curs.execute('''
-            CREATE TABLE ImageInfo (
-                img_id INT NOT NULL PRIMARY KEY,
+    # ids are rowid alias with AUTOINCREMENT, so they keep unique after deletes
+    # {} is the table name, to create the same table under a temporary name when migrating
+    table_sql = {
+        'ImageInfo': '''
+            CREATE TABLE IF NOT EXISTS {} (
+                img_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 img_dir CHAR(256) NOT NULL,
                 img_name CHAR(64) NOT NULL, 
                 width INT NOT NULL, 
                 height INT NOT NULL, 
                 default_baf REAL NOT NULL DEFAULT 2,
-                mode INT NOT NULL DEFAULT 0)''')
-        self.curs.execute('''
-            CREATE TABLE TreeInfo (
-                tree_id INT NOT NULL PRIMARY KEY,
+                mode INT NOT NULL DEFAULT 0,
+                band REAL NOT NULL DEFAULT 1,
+                enhance TEXT NOT NULL DEFAULT 'equalize',
+                lut BLOB)''',
+        'TreeInfo': '''
+            CREATE TABLE IF NOT EXISTS {} (
+                tree_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 img_id INT NOT NULL,
                 lx REAL NOT NULL,
                 ly REAL NOT NULL,
                 rx REAL NOT NULL,
                 ry REAL NOT NULL,
                 max_baf REAL NOT NULL,
-                    FOREIGN KEY (img_id) REFERENCES ImageInfo(img_id))''')
-        self.curs.execute('''
-            CREATE TABLE ClickInfo (
-                click_id INT NOT NULL PRIMARY KEY,
+                    FOREIGN KEY (img_id) REFERENCES ImageInfo(img_id))''',
+        'ClickInfo': '''
+            CREATE TABLE IF NOT EXISTS {} (
+                click_id INTEGER PRIMARY KEY AUTOINCREMENT,
                 img_id INT NOT NULL,
                 x REAL NOT NULL,
                 y REAL NOT NULL,
                 baf REAL NOT NULL,
-                    FOREIGN KEY (img_id) REFERENCES ImageInfo(img_id))''')
+                    FOREIGN KEY (img_id) REFERENCES ImageInfo(img_id))'''}
+    table_columns = {
+        'ImageInfo': 'img_id, img_dir, img_name, width, height, default_baf, mode, band, enhance, lut',
+        'TreeInfo': 'tree_id, img_id, lx, ly, rx, ry, max_baf',
+        'ClickInfo': 'click_id, img_id, x, y, baf'}
+
+    # in tree number of the images counted by one query, each image by its own (img_id, baf) index range:
+    #   edge mode (mode=0): trees with max_baf >= default_baf
+    #   click mode: clicks recorded under default_baf
+    # {where} to only count some images, the others are not read at all
+    img_info_sql = '''
+        SELECT i.img_id, i.img_dir, i.img_name, i.width, i.height, i.default_baf AS baf, i.mode, i.band, i.enhance,
+               CASE WHEN i.mode = 0
+                    THEN (SELECT COUNT(*) FROM TreeInfo t WHERE t.img_id = i.img_id AND t.max_baf >= i.default_baf)
+                    ELSE (SELECT COUNT(*) FROM ClickInfo c WHERE c.img_id = i.img_id AND c.baf = i.default_baf)
+               END AS in_num
+        FROM ImageInfo i
+        {where}'''
+    # sorting keys of get_img_ids and get_tree_ids
+    img_order_sql = {'img_id': 'img_id', 'img_name': 'img_name', 'baf': 'baf', 'in_num': 'in_num',
+                     'ba': 'baf * in_num'}
+    tree_order_sql = {'tree_id': 'tree_id', 'width': '(lx - rx) * (lx - rx) + (ly - ry) * (ly - ry)',
+                      'max_baf': 'max_baf'}
+
+    def __init__(self, db_path='test.sqlite'):
+        # callback(event, img_ids, ids) after every change of the records, ids are tree_id / click_id of the
+        # tree events, img_ids are the images changed (for tree events, the images of these trees)
+        #     'img_added', 'img_removed', 'img_changed' (columns of get_img_info)
+        #     'tree_added', 'tree_edited', 'tree_removed', 'click_added', 'click_edited', 'click_removed'
+        self.listeners = []
+        if not os.path.exists(db_path):
+            self.create_db(db_path)
+        else:  # open a table
+            self.conn = sqlite3.connect(db_path)
+            self.curs = self.conn.cursor()
+
+    def create_db(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.curs = self.conn.cursor()
+
+        for table in ['ImageInfo', 'TreeInfo', 'ClickInfo']:
+            self.curs.execute(self.table_sql[table].format(table))
+        self.create_index()
         self.conn.commit()
         self.db_path = db_path
 
+    def create_index(self):
+        # per image lookups (get_tree_info, get_click_info, rm_img and in tree counting)
+        # use these instead of scanning the whole table
+        self.curs.execute('CREATE INDEX IF NOT EXISTS TreeInfo_img_baf ON TreeInfo (img_id, max_baf)')
+        self.curs.execute('CREATE INDEX IF NOT EXISTS ClickInfo_img_baf ON ClickInfo (img_id, baf)')
+
 
     def change_db(self, db_path):
         self.conn.close()
@@ -57,189 +104,356 @@ class DataBase:
         self.curs = self.conn.cursor()
         self.db_path = db_path
 
+    def get_table_names(self):
+        # user tables only, the sqlite_sequence used by AUTOINCREMENT is excluded
+        self.curs.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        return {r[0] for r in self.curs.fetchall()}
+
     def update_db(self):
         # add a ref.ball mode here, fit to previous database
-        self.curs.execute('''
-            CREATE TABLE IF NOT EXISTS ClickInfo (
-                click_id INT NOT NULL PRIMARY KEY,
-                img_id INT NOT NULL,
-                x REAL NOT NULL,
-                y REAL NOT NULL,
-                baf REAL NOT NULL,
-                    FOREIGN KEY (img_id) REFERENCES ImageInfo(img_id))''')
+        self.curs.execute(self.table_sql['ClickInfo'].format('ClickInfo'))
         try:
             self.curs.execute('''
                 ALTER TABLE ImageInfo ADD COLUMN mode INT NOT NULL DEFAULT 0''')
         except:
             pass
+        # band mode, the kept vertical band around horizon (ratio of image height), 1 is the whole image
+        try:
+            self.curs.execute('''
+                ALTER TABLE ImageInfo ADD COLUMN band REAL NOT NULL DEFAULT 1''')
+        except:
+            pass
+        # image enhancement method, and its lookup table saved when first computed
+        try:
+            self.curs.execute('''
+                ALTER TABLE ImageInfo ADD COLUMN enhance TEXT NOT NULL DEFAULT 'equalize' ''')
+            self.curs.execute('''
+                ALTER TABLE ImageInfo ADD COLUMN lut BLOB''')
+        except:
+            pass
+        # previous database use "INT PRIMARY KEY" with MAX(id)+1 allocation,
+        # rebuild these tables to rowid ids, the old ids are kept
+        for table in ['ImageInfo', 'TreeInfo', 'ClickInfo']:
+            self.curs.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", [table])
+            if 'AUTOINCREMENT' not in self.curs.fetchone()[0].upper():
+                columns = self.table_columns[table]
+                self.curs.execute(self.table_sql[table].format(table + '_new'))
+                self.curs.execute('INSERT INTO {}_new ({}) SELECT {} FROM {}'.format(table, columns, columns, table))
+                self.curs.execute('DROP TABLE ' + table)
+                self.curs.execute('ALTER TABLE {}_new RENAME TO {}'.format(table, table))
+        # add secondary index to previous database
+        self.create_index()
 
         self.commit()
 
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def _emit(self, event, img_ids, ids=()):
+        for callback in self.listeners:
+            callback(event, list(img_ids), list(ids))
+
+    def _img_ids_of(self, table, id_column, ids):
+        # images of trees or clicks, only looked up for the listeners
+        if not self.listeners:
+            return []
+        self.curs.execute('select distinct img_id from {} where {} in ({})'.format(
+            table, id_column, ','.join(str(int(i)) for i in ids)))
+        return [r[0] for r in self.curs.fetchall()]
+
     def add_img(self, img_path, mode=0):
-        im = Image.open(img_path)
-        width, height = im.size
+        width, height = self.probe_img_size(img_path)
         img_name_ext = os.path.basename(img_path)
         img_name = os.path.splitext(img_name_ext)[0]
 
-        self.curs.execute('select MAX(img_id) from ImageInfo')
-        max_id = self.curs.fetchone()[0]
-        if max_id is None:
-            img_id = 0
-        else:
-            img_id = max_id + 1
+        self.curs.execute('insert into ImageInfo (img_dir, img_name, width, height, default_baf, mode) '
+                          'values (?,?,?,?,?,?)', (img_path, img_name, width, height, 2, mode))
+        self._emit('img_added', [self.curs.lastrowid])
+        return self.curs.lastrowid
+
+    def add_imgs(self, img_paths, modes, progress=None, max_workers=8):
+        # batch version of add_img, image sizes are probed by a thread pool (file reading releases the GIL)
+        # then inserted by one executemany
+        # progress(done_num, total_num) is called in the calling thread after each probed file
+        sizes = [None] * len(img_paths)
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(self.probe_img_size, img_path): i for i, img_path in enumerate(img_paths)}
+            for done_num, future in enumerate(as_completed(futures)):
+                sizes[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done_num + 1, len(img_paths))
+
+        rows = []
+        for img_path, mode, (width, height) in zip(img_paths, modes, sizes):
+            img_name = os.path.splitext(os.path.basename(img_path))[0]
+            rows.append((img_path, img_name, width, height, 2, mode))
+        self.curs.executemany('insert into ImageInfo (img_dir, img_name, width, height, default_baf, mode) '
+                              'values (?,?,?,?,?,?)', rows)
+        img_ids = self._get_last_ids('ImageInfo', len(rows))
+        self._emit('img_added', img_ids)
+        return img_ids
 
-        self.curs.execute('insert into ImageInfo values (?,?,?,?,?,?,?)',
-                          (img_id, img_path, img_name, width, height, 2, mode))
+    @staticmethod
+    def probe_img_size(img_path):
+        # Image.open only parses the JPEG/PNG header, pixels are never decoded here
+        with Image.open(img_path) as im:
+            return im.size
+
+    def get_img_dirs(self):
+        self.curs.execute('select img_dir from ImageInfo')
+        return [r[0] for r in self.curs.fetchall()]
 
     def rm_img(self, img_id):
         self.curs.execute('delete from ImageInfo where img_id = ?', [img_id])
         self.curs.execute('delete from TreeInfo where img_id = ?', [img_id])
+        self._emit('img_removed', [img_id])
 
     def edit_img_mode(self, img_id, mode=0):
         self.curs.execute('update ImageInfo set mode = ? where img_id = ?', [mode, img_id])
+        self._emit('img_changed', [img_id])
 
     def edit_img_baf(self, img_id, baf):
         self.curs.execute('update ImageInfo set default_baf = ? where img_id = ?', [baf, img_id])
+        self._emit('img_changed', [img_id])
+
+    def edit_img_band(self, img_id, band):
+        # the lookup table is of the histogram in band, compute it again
+        self.curs.execute('update ImageInfo set band = ?, lut = NULL where img_id = ?', [band, img_id])
+        self._emit('img_changed', [img_id])
+
+    def edit_img_enhance(self, img_id, enhance):
+        self.curs.execute('update ImageInfo set enhance = ?, lut = NULL where img_id = ?', [enhance, img_id])
+        self._emit('img_changed', [img_id])
+
+    def edit_img_lut(self, img_id, lut):
+        # in the pending changes as the other edits, the GUI marks the project unsaved after it
+        self.curs.execute('update ImageInfo set lut = ? where img_id = ?', [lut, img_id])
+
+    def get_img_lut(self, img_id):
+        # the saved enhancement lookup table (768 bytes), None if not computed yet
+        self.curs.execute('select lut from ImageInfo where img_id = ?', [img_id])
+        r = self.curs.fetchone()
+        return None if r is None or r[0] is None else bytes(r[0])
 
     def edit_img_baf_all(self, baf):
         self.curs.execute('update ImageInfo set default_baf = ?', [baf])
-
-    def get_img_info(self):
-        self.curs.execute('select img_id, img_dir, img_name, width, height, default_baf, mode from ImageInfo')
-        img_info = {'img_id': [], 'img_dir': [], 'img_name': [],
-                    'width': [], 'height': [], 'baf': [], 'mode':[], 'in_num': [], 'ba': []}
-        for r in self.curs.fetchall():
-            img_info['img_id'].append(r[0])
-            img_info['img_dir'].append(r[1])
-            img_info['img_name'].append(r[2])
-            img_info['width'].append(r[3])
-            img_info['height'].append(r[4])
-            img_info['baf'].append(r[5])
-            img_info['mode'].append(r[6])
-
-        for i, img_id in enumerate(img_info['img_id']):
-            baf = img_info['baf'][i]
-            mode = img_info['mode'][i]
-            if mode == 0:
-                self.curs.execute('select tree_id from TreeInfo where img_id = ? and max_baf >= ?', [img_id, baf])
-                in_num = len(self.curs.fetchall())
-            else:
-                self.curs.execute(('select click_id from ClickInfo where img_id = ? and baf = ?'), [img_id, baf])
-                in_num = len(self.curs.fetchall())
-
-            ba = plot_ba_calculator(baf, in_num)
-            img_info['in_num'].append(in_num)
-            img_info['ba'].append(ba)
-
-        return img_info
+        if self.listeners:
+            self.curs.execute('select img_id from ImageInfo')
+            self._emit('img_changed', [r[0] for r in self.curs.fetchall()])
+
+    def get_img_info(self, img_ids=None):
+        # all the images, or only the ones of img_ids
+        where = '' if img_ids is None else 'WHERE i.img_id IN ({})'.format(','.join(str(int(i)) for i in img_ids))
+        self.curs.execute(self.img_info_sql.format(where=where) + ' ORDER BY i.img_id')
+        rows = self.curs.fetchall()
+        names = ['img_id', 'img_dir', 'img_name', 'width', 'height', 'baf', 'mode', 'band', 'enhance', 'in_num']
+        values = {name: [r[i] for r in rows] for i, name in enumerate(names)}
+
+        # BA of all the images in one vectorized call
+        values['ba'] = plot_ba_calculator(array(values['baf'], dtype=float), array(values['in_num'], dtype=int))
+
+        return ColumnStore.from_columns(img_columns, 'img_id', values)
+
+    def get_img_ids(self, order='img_id', descending=False, keyword=''):
+        # img_id of the images whose name contains keyword, sorted by order (img_order_sql),
+        # both done by sqlite, the GUI only shows the visible ones of them
+        self.curs.execute('SELECT img_id FROM ({}) WHERE img_name LIKE ? ORDER BY {} {}, img_id'.format(
+            self.img_info_sql.format(where=''), self.img_order_sql[order], 'DESC' if descending else 'ASC'), ['%' + keyword + '%'])
+        return [r[0] for r in self.curs.fetchall()]
+
+    def get_tree_ids(self, img_id, order='tree_id', descending=False):
+        # tree_id of an image sorted by order (tree_order_sql), width by its square
+        self.curs.execute('SELECT tree_id FROM TreeInfo WHERE img_id = ? ORDER BY {} {}, tree_id'.format(
+            self.tree_order_sql[order], 'DESC' if descending else 'ASC'), [img_id])
+        return [r[0] for r in self.curs.fetchall()]
 
     def get_img_info_baf_range(self, baf_list):
         img_info_all = {'img_id':[], 'img_name':[], 'baf_num_ba':[]}
-        self.curs.execute('select img_id from ImageInfo')
-
-        img_info_all['img_id'] = [r[0] for r in self.curs.fetchall()]
-
+        self.curs.execute('select img_id, img_name from ImageInfo')
+        for img_id, img_name in self.curs.fetchall():
+            img_info_all['img_id'].append(img_id)
+            img_info_all['img_name'].append(img_name)
+
+        baf_array = asarray(baf_list, dtype=float)
+        max_baf_index = self.get_max_baf_index()
+        no_tree = empty(0)
         for img_id in img_info_all['img_id']:
-            self.curs.execute('select img_name from ImageInfo where img_id = ?', [img_id])
-            img_info_all['img_name'].append(self.curs.fetchone()[0])
-            baf_num_ba = []
-            for baf in baf_list:
-                self.curs.execute('select tree_id from TreeInfo where img_id =? and max_baf >= ?', [img_id, baf])
-                in_num = len(self.curs.fetchall())
-                ba = plot_ba_calculator(baf, in_num)
-                baf_num_ba.append(ba)
-                #baf_num_ba.append(in_num)
-
-            img_info_all['baf_num_ba'].append(baf_num_ba)
+            in_num = in_tree_count(max_baf_index.get(img_id, no_tree), baf_array)
+            baf_num_ba = plot_ba_calculator(baf_array, in_num)
+            img_info_all['baf_num_ba'].append(baf_num_ba.tolist())
 
         return img_info_all
 
-    def add_tree(self, img_id, lx, ly, rx, ry, return_value=False):
-        self.curs.execute('select MAX(tree_id) from TreeInfo')
-        max_id = self.curs.fetchone()[0]
-        if max_id is None:
-            tree_id = 0
-        else:
-            tree_id = max_id + 1
-
-        self.curs.execute('select width from ImageInfo where img_id = ?', [img_id])
-        img_width = self.curs.fetchone()[0]
+    def get_max_baf_index(self):
+        # {img_id: ascending max_baf array} of all the images, built by only one query
+        # the in tree number of any baf is then in_tree_count(max_baf_index[img_id], baf)
+        self.curs.execute('select img_id, max_baf from TreeInfo order by img_id, max_baf')
+        rows = self.curs.fetchall()
+
+        max_baf_index = {}
+        if len(rows) > 0:
+            ti = array(rows, dtype=float)
+            img_ids, starts = unique(ti[:, 0], return_index=True)
+            for img_id, max_bafs in zip(img_ids.astype(int).tolist(), split(ti[:, 1], starts[1:])):
+                max_baf_index[img_id] = max_bafs
+
+        return max_baf_index
+
+    def add_tree(self, img_id, lx, ly, rx, ry, return_value=False, img_width=None):
+        # img_width is the image width already known by the caller, saves a lookup query
+        if img_width is None:
+            self.curs.execute('select width from ImageInfo where img_id = ?', [img_id])
+            img_width = self.curs.fetchone()[0]
         baf_max = self.max_baf_calculator(lx, ly, rx, ry, img_width)
 
-        self.curs.execute('insert into TreeInfo values (?,?,?,?,?,?,?)',
-                          (tree_id, img_id, lx, ly, rx, ry, baf_max))
+        self.curs.execute('insert into TreeInfo (img_id, lx, ly, rx, ry, max_baf) values (?,?,?,?,?,?)',
+                          (img_id, lx, ly, rx, ry, baf_max))
+        tree_id = self.curs.lastrowid
+        self._emit('tree_added', [img_id], [tree_id])
         width = self.length_calculator(lx, ly, rx, ry)
         if return_value:
             return tree_id, width, baf_max  # same order as get_tree_info
 
-    def add_click(self, img_id,  x, y, return_value=False):
-        self.curs.execute('select MAX(click_id) from ClickInfo')
-        max_id = self.curs.fetchone()[0]
-        if max_id is None:
-            click_id = 0
-        else:
-            click_id = max_id + 1
-
-        self.curs.execute('select default_baf from ImageInfo where img_id = ?', [img_id])
-        baf = self.curs.fetchone()[0]
-
-        self.curs.execute('select width from ImageInfo where img_id = ?', [img_id])
-        img_width = self.curs.fetchone()[0]
+    def add_click(self, img_id,  x, y, return_value=False, baf=None, img_width=None):
+        # baf (image default baf) and img_width already known by the caller save lookup queries
+        if baf is None or img_width is None:
+            self.curs.execute('select default_baf, width from ImageInfo where img_id = ?', [img_id])
+            baf, img_width = self.curs.fetchone()
 
         diameter_pixel = int(in_tree_pixel(baf, img_width))
 
-        self.curs.execute('insert into ClickInfo values (?,?,?,?,?)', [click_id, img_id, x, y, baf])
+        self.curs.execute('insert into ClickInfo (img_id, x, y, baf) values (?,?,?,?)', [img_id, x, y, baf])
+        click_id = self.curs.lastrowid
+        self._emit('click_added', [img_id], [click_id])
 
         if return_value:
             return click_id, diameter_pixel
 
+    def add_trees(self, img_id, lx, ly, rx, ry, return_value=False, img_width=None):
+        # batch version of add_tree, lx, ly, rx, ry are sequences or numpy arrays of the same length
+        # img_id (and img_width) can be one value for all the trees or one value per tree
+        lx, ly, rx, ry = [asarray(v, dtype=float) for v in (lx, ly, rx, ry)]
+        img_id = broadcast_to(asarray(img_id, dtype=int), lx.shape)
+        if img_width is None:
+            img_width = self._get_img_column(img_id, 'width')
+        baf_max = self.max_baf_calculator(lx, ly, rx, ry, img_width)
+
+        rows = zip(img_id.tolist(), lx.tolist(), ly.tolist(), rx.tolist(), ry.tolist(), baf_max.tolist())
+        self.curs.executemany('insert into TreeInfo (img_id, lx, ly, rx, ry, max_baf) values (?,?,?,?,?,?)', rows)
+        tree_ids = self._get_last_ids('TreeInfo', len(lx))
+        self._emit('tree_added', unique(img_id).tolist(), tree_ids)
+        if return_value:
+            widths = tree_width_pixel(lx, ly, rx, ry).tolist()
+            return tree_ids, widths, baf_max.tolist()  # same order as add_tree
+
+    def add_clicks(self, img_id, x, y, return_value=False, baf=None, img_width=None):
+        # batch version of add_click, x, y are sequences or numpy arrays of the same length
+        # img_id, baf and img_width can be one value for all the clicks or one value per click
+        x, y = asarray(x, dtype=float), asarray(y, dtype=float)
+        img_id = broadcast_to(asarray(img_id, dtype=int), x.shape)
+        if baf is None:
+            baf = self._get_img_column(img_id, 'default_baf')
+        if img_width is None:
+            img_width = self._get_img_column(img_id, 'width')
+        baf = broadcast_to(asarray(baf, dtype=float), x.shape)
+
+        rows = zip(img_id.tolist(), x.tolist(), y.tolist(), baf.tolist())
+        self.curs.executemany('insert into ClickInfo (img_id, x, y, baf) values (?,?,?,?)', rows)
+        click_ids = self._get_last_ids('ClickInfo', len(x))
+        self._emit('click_added', unique(img_id).tolist(), click_ids)
+        if return_value:
+            diameter_pixel = in_tree_pixel(baf, img_width).astype(int).tolist()
+            return click_ids, diameter_pixel  # same order as add_click
+
     def rm_tree(self, tree_id):
-        self.curs.execute('delete from TreeInfo where tree_id = ?', [tree_id])
+        self.rm_trees([tree_id])
 
-    def rm_click(self, click_id):
-        self.curs.execute('delete from ClickInfo where click_id = ?', [click_id])
+    def rm_trees(self, tree_ids):
+        # batch version of rm_tree, tree_ids is a sequence or numpy array
+        tree_ids = asarray(tree_ids, dtype=int).tolist()
+        img_ids = self._img_ids_of('TreeInfo', 'tree_id', tree_ids)
+        self.curs.executemany('delete from TreeInfo where tree_id = ?', [[i] for i in tree_ids])
+        self._emit('tree_removed', img_ids, tree_ids)
 
-    def edit_tree(self, tree_id, lx, ly, rx, ry, return_value=False):
-        self.curs.execute('select img_id from TreeInfo where tree_id = ?', [tree_id])
-        img_id = self.curs.fetchone()[0]
-        self.curs.execute('select width from ImageInfo where img_id = ?', [img_id])
-        img_width = self.curs.fetchone()[0]
+    def rm_click(self, click_id):
+        self.rm_clicks([click_id])
+
+    def rm_clicks(self, click_ids):
+        # batch version of rm_click, click_ids is a sequence or numpy array
+        click_ids = asarray(click_ids, dtype=int).tolist()
+        img_ids = self._img_ids_of('ClickInfo', 'click_id', click_ids)
+        self.curs.executemany('delete from ClickInfo where click_id = ?', [[i] for i in click_ids])
+        self._emit('click_removed', img_ids, click_ids)
+
+    def _get_img_column(self, img_ids, column):
+        # ImageInfo column value of each img_id in img_ids (numpy array), by one query
+        ids, inverse = unique(img_ids, return_inverse=True)
+        ids = ids.tolist()
+        self.curs.execute('select img_id, {} from ImageInfo where img_id in ({})'.format(
+            column, ','.join('?' * len(ids))), ids)
+        value_of = dict(self.curs.fetchall())
+        missing = [i for i in ids if i not in value_of]
+        if missing:
+            raise ValueError('img_id {} not in ImageInfo'.format(missing))
+        return array([value_of[i] for i in ids])[inverse]
+
+    def _get_last_ids(self, table, num):
+        # ids of the last num rows inserted by executemany, AUTOINCREMENT ids are consecutive here
+        if num == 0:
+            return []
+        self.curs.execute('select seq from sqlite_sequence where name = ?', [table])
+        last_id = self.curs.fetchone()[0]
+        return arange(last_id - num + 1, last_id + 1).tolist()
+
+    def edit_tree(self, tree_id, lx, ly, rx, ry, return_value=False, img_width=None):
+        if img_width is None:
+            self.curs.execute('select width from ImageInfo where img_id = '
+                              '(select img_id from TreeInfo where tree_id = ?)', [tree_id])
+            img_width = self.curs.fetchone()[0]
 
         width = self.length_calculator(lx, ly, rx, ry)
         baf_max = self.max_baf_calculator(lx, ly, rx, ry, img_width)
 
         self.curs.execute('update TreeInfo set lx = ?, ly = ?, rx = ?, ry = ?, max_baf = ? where tree_id = ?',
                           [lx, ly, rx, ry, baf_max, tree_id])
+        self._emit('tree_edited', self._img_ids_of('TreeInfo', 'tree_id', [tree_id]), [tree_id])
         if return_value:
             return width, baf_max
 
     def edit_click(self, click_id, x, y, return_value=False):
         self.curs.execute('update ClickInfo set x=?, y=? where click_id = ?', [x, y, click_id])
+        self._emit('click_edited', self._img_ids_of('ClickInfo', 'click_id', [click_id]), [click_id])
+
+    @staticmethod
+    def _ids_sql(column, ids):
+        # condition of only some ids, '' for all
+        return '' if ids is None else ' AND {} IN ({})'.format(column, ','.join(str(int(i)) for i in ids))
 
-    def get_tree_info(self, img_id):
+    def get_tree_info(self, img_id, tree_ids=None):
+        # all the trees of img_id, or only the ones of tree_ids
         self.curs.execute('select default_baf from ImageInfo where img_id = ?', [img_id])
         default_baf = self.curs.fetchone()
 
-        tree_info = {'tree_id': [], 'left': [], 'right': [], 'width': [], 'state': []}
+        tree_info = {name: [] for name, dtype in tree_columns}
 
         if default_baf is not None:
             default_baf = default_baf[0]
-            self.curs.execute('select tree_id, lx, ly, rx, ry, max_baf from TreeInfo where img_id = ?', [img_id])
-
-            for ti in self.curs.fetchall():
-                tree_info['tree_id'].append(ti[0])
-                tree_info['left'].append([ti[1], ti[2]])
-                tree_info['right'].append([ti[3], ti[4]])
-                tree_info['width'].append(self.length_calculator(ti[1], ti[2], ti[3], ti[4]))
-                if ti[5] >= default_baf:
-                    state = 'in'
-                else:
-                    state = 'out'
-                tree_info['state'].append(state)
-
-        return tree_info
-
-    def get_click_info(self, img_id):
+            self.curs.execute('select tree_id, lx, ly, rx, ry, max_baf from TreeInfo where img_id = ?{} '
+                              'order by tree_id'.format(self._ids_sql('tree_id', tree_ids)), [img_id])
+            rows = self.curs.fetchall()
+
+            if len(rows) > 0:
+                ti = array(rows, dtype=float)
+                tree_info['tree_id'] = ti[:, 0]
+                tree_info['lx'], tree_info['ly'], tree_info['rx'], tree_info['ry'] = ti[:, 1], ti[:, 2], ti[:, 3], ti[:, 4]
+                tree_info['width'] = tree_width_pixel(ti[:, 1], ti[:, 2], ti[:, 3], ti[:, 4])
+                tree_info['max_baf'] = ti[:, 5]
+                tree_info['state'] = (ti[:, 5] >= default_baf) * IN_TREE
+
+        return TreeStore.from_columns(0, tree_info)
+
+    def get_click_info(self, img_id, click_ids=None):
+        # clicks of img_id under its default baf, or only the ones of click_ids
         self.curs.execute('select default_baf from ImageInfo where img_id = ?', [img_id])
         default_baf = self.curs.fetchone()
 
@@ -248,52 +462,50 @@ class DataBase:
 
         diameter_pixel = int(in_tree_pixel(default_baf[0], img_width))
 
-        click_info = {'click_id':[], 'x':[], 'y':[], 'width':[], 'state':[]}
+        click_info = {name: [] for name, dtype in click_columns}
 
         if default_baf is not None:
             default_baf = default_baf[0]
-            self.curs.execute('select click_id, x, y from ClickInfo where img_id = ? AND baf=?', [img_id, default_baf])
-
-            for ci in self.curs.fetchall():
-                click_info['click_id'].append(ci[0])
-                click_info['x'].append(ci[1])
-                click_info['y'].append(ci[2])
-                click_info['width'].append(diameter_pixel)
-                click_info['state'].append('in')
-
-        return click_info
+            self.curs.execute('select click_id, x, y from ClickInfo where img_id = ? AND baf=?{} '
+                              'order by click_id'.format(self._ids_sql('click_id', click_ids)), [img_id, default_baf])
+            rows = self.curs.fetchall()
+            click_info['click_id'] = [r[0] for r in rows]
+            click_info['x'] = [r[1] for r in rows]
+            click_info['y'] = [r[2] for r in rows]
+            click_info['width'] = [diameter_pixel] * len(rows)
+            click_info['state'] = [IN_TREE] * len(rows)
 
+        return TreeStore.from_columns(1, click_info)
 
     def get_tree_info_all(self):
-        self.curs.execute('select img_id, tree_id, lx, ly, rx, ry, max_baf from TreeInfo order by img_id')
-        tree_info_all = {'img_id':[], 'tree_id':[], 'width':[], 'max_baf':[]}
-        for item in self.curs.fetchall():
-            tree_info_all['img_id'].append(item[0])
-            tree_info_all['tree_id'].append(item[1])
-            tree_info_all['width'].append(self.length_calculator(item[2], item[3], item[4], item[5]))
-            tree_info_all['max_baf'].append(item[6])
-
-        return tree_info_all
+        self.curs.execute('select img_id, tree_id, lx, ly, rx, ry, max_baf from TreeInfo order by img_id, tree_id')
+        tree_info_all = {name: [] for name, dtype in tree_all_columns}
+        rows = self.curs.fetchall()
+        if len(rows) > 0:
+            ti = array(rows, dtype=float)
+            tree_info_all['img_id'] = ti[:, 0]
+            tree_info_all['tree_id'] = ti[:, 1]
+            tree_info_all['width'] = tree_width_pixel(ti[:, 2], ti[:, 3], ti[:, 4], ti[:, 5])
+            tree_info_all['max_baf'] = ti[:, 6]
+
+        return ColumnStore.from_columns(tree_all_columns, 'tree_id', tree_info_all)
 
     def get_click_info_all(self):
-        self.curs.execute('select img_id, click_id, x, y, baf from ClickInfo order by img_id, baf')
-        click_info_all = {'img_id':[], 'click_id':[], 'x':[], 'y':[], 'baf':[]}
-        for item in self.curs.fetchall():
-            click_info_all['img_id'].append(item[0])
-            click_info_all['click_id'].append(item[1])
-            click_info_all['x'].append(item[2])
-            click_info_all['y'].append(item[3])
-            click_info_all['baf'].append((item[4]))
+        self.curs.execute('select img_id, click_id, x, y, baf from ClickInfo order by img_id, baf, click_id')
+        rows = self.curs.fetchall()
+        click_info_all = {name: [r[i] for r in rows] for i, (name, dtype) in enumerate(click_all_columns)}
 
-        return click_info_all
+        return ColumnStore.from_columns(click_all_columns, 'click_id', click_info_all)
 
     def commit(self):
         self.conn.commit()
 
-    def max_baf_calculator(self, lx, ly, rx, ry, img_width):
-        diameter_pixel = self.length_calculator(lx, ly, rx, ry)
+    @staticmethod
+    def max_baf_calculator(lx, ly, rx, ry, img_width):
+        # accept scalars or numpy arrays of tree edge coordinates
+        diameter_pixel = tree_width_pixel(lx, ly, rx, ry)
         baf_max = max_baf(img_width, diameter_pixel)
-        return baf_max
+        return float(baf_max) if baf_max.ndim == 0 else baf_max
 
     @staticmethod
     def length_calculator(lx, ly, rx, ry):
@@ -309,34 +521,34 @@ if __name__ == '__main__':
     db.add_img(r'..\images\examples\COR R1 S00 0 16.JPG')
     db.add_img(r'..\images\examples\COR R1 S00 1 16.JPG')
     # testing remove img
-    db.rm_img(0)
-    # testing add img to discontinuous img_id
+    db.rm_img(1)
+    # testing add img after removing, ids are never reused
     db.add_img(r'..\images\examples\COR R1 S12 0 16.JPG')
     db.add_img(r'..\images\examples\COR R1 S12 1 16.JPG')
     # testing edit baf info without trees
-    db.edit_img_baf(img_id=1, baf=3)
+    db.edit_img_baf(img_id=2, baf=3)
     # try to update non exist img
     db.edit_img_baf(0, 3.4)
     # add trees to test
-    db.add_tree(img_id=1, lx=360, ly=720, rx=658, ry=720)
-    db.add_tree(img_id=1, lx=360, ly=720, rx=358, ry=720)  # lx < rx
-    db.add_tree(img_id=2, lx=390, ly=720, rx=458, ry=770)  # not horizontal
-    db.add_tree(img_id=2, lx=380, ly=720, rx=489, ry=720)
-    db.add_click(img_id=1, x=300, y=500)
-    db.add_click(img_id=1, x=500, y=765)
-    db.add_click(img_id=2, x=5640, y=725)
+    db.add_tree(img_id=2, lx=360, ly=720, rx=658, ry=720)
+    db.add_tree(img_id=2, lx=360, ly=720, rx=358, ry=720)  # lx < rx
+    db.add_tree(img_id=3, lx=390, ly=720, rx=458, ry=770)  # not horizontal
+    db.add_tree(img_id=3, lx=380, ly=720, rx=489, ry=720)
+    db.add_click(img_id=2, x=300, y=500)
+    db.add_click(img_id=2, x=500, y=765)
+    db.add_click(img_id=3, x=5640, y=725)
     # test delete tree
-    db.rm_tree(tree_id=0)
-    db.rm_click(click_id=1)
+    db.rm_tree(tree_id=1)
+    db.rm_click(click_id=2)
     # test update tree info
-    db.edit_tree(tree_id=3, lx=240, ly=430, rx=261, ry=430)
-    db.edit_click(click_id=2, x=430, y=370)
+    db.edit_tree(tree_id=4, lx=240, ly=430, rx=261, ry=430)
+    db.edit_click(click_id=3, x=430, y=370)
     # test getting info from db for gui.py
     print(db.get_img_info())
-    print(db.get_tree_info(img_id=2))
-    print(db.get_click_info(img_id=2))
+    print(db.get_tree_info(img_id=3))
+    print(db.get_click_info(img_id=3))
     # testing edit baf info and change tree info at the same time
-    db.edit_img_baf(img_id=2, baf=300)
-    print(db.get_tree_info(img_id=2))
-    print(db.get_click_info(img_id=2))
+    db.edit_img_baf(img_id=3, baf=300)
+    print(db.get_tree_info(img_id=3))
+    print(db.get_click_info(img_id=3))
     db.commit()
\ No newline at end of file
@@ -22,32 +22,44 @@ GUI class structure:
 ############################################################################
 """
 import os
+import re
 import sys
 import xlwt
 import traceback
-from tkinter import Tk, Button, Menubutton, Menu, Canvas, Scrollbar, Label, Frame, TclError, IntVar, Radiobutton
+from itertools import islice
+from queue import Queue, Empty
+from concurrent.futures import ThreadPoolExecutor
+from tkinter import Tk, Button, Menubutton, Menu, Canvas, Scrollbar, Label, Frame, IntVar, StringVar, \
+    Radiobutton, Entry
 from tkinter.simpledialog import askstring, askfloat
 from tkinter.filedialog import asksaveasfilename, askopenfilename, askdirectory
 from tkinter.messagebox import askokcancel, showwarning, showinfo, showerror, askyesno, askyesnocancel
-from tkinter.ttk import Treeview, Progressbar
+from tkinter.ttk import Progressbar
 from PIL import Image, ImageDraw
 from PIL.ImageTk import PhotoImage
-from PIL.ImageOps import equalize
 from db import DataBase
-from numpy import ones, arange, sqrt, sin, cos, pi
-from ba import plot_ba_calculator, max_baf, in_tree_pixel
+from numpy import arange, sqrt, sin, cos, pi, array, asarray, empty, hstack, column_stack
+from ba import max_baf, in_tree_pixel
+from spatial import PointGrid
+from store import ColumnStore, TreeStore, IN_TREE, img_columns
+from vtable import VirtualTable
+from imgproc import resize_from_pyramid, render_tile, draft_scale, band_rows, ImageCache, DiskCache, Prefetcher, \
+    default_options
 
 
 class Pano2BA(Tk):
 
     saved = True
     title_name = 'Panorama2BA'
-    img_info = {'img_id': [], 'img_dir': [], 'img_name': [],
-                'width': [], 'height': [], 'baf': [], 'in_num': [], 'ba': []}
-    # edge mode
-    tree_info = {'tree_id': [], 'left': [], 'right': [], 'width': [], 'state': []}
-    # click mode
-    # tree_info = {'click_id': [], 'x':[], 'y':[], 'width':[], 'state':[]}
+    import_preview_num = 100  # image names listed in the import confirm dialog
+    prefetch_num = 2  # previous and next images in img_table preprocessed in background
+    # table heading: sorting key of db.get_img_ids and db.get_tree_ids
+    img_order = {'Image Name': 'img_name', 'BAF': 'baf', 'In': 'in_num', 'BA': 'ba'}
+    tree_order = {'No.': 'tree_id', 'Width': 'width', 'State': 'max_baf'}
+    img_info = ColumnStore(img_columns, 'img_id')
+    # edge mode: TreeStore(0) of tree_id, lx, ly, rx, ry, width, max_baf, state
+    # click mode: TreeStore(1) of click_id, x, y, width, state
+    tree_info = TreeStore(0)
 
     def __init__(self):
         Tk.__init__(self)
@@ -71,8 +83,10 @@ class Pano2BA(Tk):
 
         self.left_frame = Frame(self)
         self.img_label = Label(self.left_frame, text="Image Management Panel")
-        self.img_table = Treeview(self.left_frame, show="headings", columns=('Image Name', 'BAF', 'In', 'BA'))
-        self.img_table_bar = Scrollbar(self.left_frame)
+        self.img_filter = StringVar()
+        self.img_filter_entry = Entry(self.left_frame, textvariable=self.img_filter)
+        self.img_table = VirtualTable(self.left_frame, [('Image Name', 130), ('BAF', 40), ('In', 40), ('BA', 40)],
+                                      self.img_table_values, sorter=self.sort_img_table)
 
         self.btn_frame = Frame(self.left_frame)
         self.add_img_btn = Button(self.btn_frame, text="Add img(s)", state='disabled', command=self.add_img)
@@ -85,8 +99,8 @@ class Pano2BA(Tk):
                                      variable=self.mode, value=0)
         self.ball_mode = Radiobutton(self.mode_frame, text="Ref.Ball Clicking", command=self.change_selection_mode,
                                     variable=self.mode, value=1)
-        self.tree_table = Treeview(self.right_frame, show="headings", columns=('No.', 'Width', 'State'))
-        self.tree_table_bar = Scrollbar(self.right_frame)
+        self.tree_table = VirtualTable(self.right_frame, [('No.', 40), ('Width', 50), ('State', 45)],
+                                       self.tree_table_values, sorter=self.sort_tree_table)
         self.del_tree_btn = Button(self.right_frame, text="Del selection(s)", state='disabled', command=self.del_tree)
 
         self.ScrolledCanvas = ScrolledCanvas(self)
@@ -98,27 +112,7 @@ class Pano2BA(Tk):
         self.del_img_btn.config(bg='white')
         self.del_tree_btn.config(bg='white')
 
-        self.img_table.column('Image Name', width=130, anchor='center')
-        self.img_table.column('BAF', width=40, anchor='center')
-        self.img_table.column('In', width=40, anchor='center')
-        self.img_table.column('BA', width=40, anchor='center')
-        self.img_table.heading('Image Name', text='Image Name')
-        self.img_table.heading('BAF', text='BAF')
-        self.img_table.heading('In', text='In')
-        self.img_table.heading('BA', text='BA')
-
-        self.img_table_bar.config(command=self.img_table.yview, bg='white')
-        self.img_table.config(yscrollcommand=self.img_table_bar.set)
-
-        self.tree_table.column('No.', width=40, anchor='center')
-        self.tree_table.column('Width', width=50, anchor='center')
-        self.tree_table.column('State', width=45, anchor='center')
-        self.tree_table.heading('No.', text='No.')
-        self.tree_table.heading('Width', text='Width')
-        self.tree_table.heading('State', text='State')
-
-        self.tree_table_bar.config(command=self.tree_table.yview, bg='white')
-        self.tree_table.config(yscrollcommand=self.tree_table_bar.set)
+        self.img_filter_entry.bind('<Return>', self.filter_img_table)
 
         self.bind('<Control-n>', self.MenuBar.new_project)
         self.bind('<Control-o>', self.MenuBar.open_project)
@@ -135,6 +129,7 @@ class Pano2BA(Tk):
         self.img_table.bind('<ButtonRelease-1>', self.open_img_project)
         self.img_table.bind('<Button-3>', self.change_baf)
         self.img_table.bind('<Button-2>', self.change_baf_all)
+        self.img_table.bind('<Shift-Button-3>', self.change_band)
 
         self.tree_table.bind('<ButtonRelease-1>', self.center_tree)
         self.tree_table.bind('<KeyPress-Delete>', self.del_tree)
@@ -151,7 +146,7 @@ class Pano2BA(Tk):
         self.btn_frame.pack(side='bottom', fill='x')
         self.add_img_btn.pack(side='left', fill='x', expand='yes')
         self.del_img_btn.pack(side='right', fill='x', expand='yes')
-        self.img_table_bar.pack(side='right', fill='y')
+        self.img_filter_entry.pack(side='top', fill='x')
         self.img_table.pack(side='top', fill='y', expand='yes')
 
         self.right_frame.pack(side='right', fill='y')
@@ -160,7 +155,6 @@ class Pano2BA(Tk):
         self.edge_mode.pack(side="left", fill='both')
         self.ball_mode.pack(side="right", fill='both')
         self.del_tree_btn.pack(side='bottom', fill='x')
-        self.tree_table_bar.pack(side='right', fill='y')
         self.tree_table.pack(side='top', fill='both', expand='yes')
 
 
@@ -178,7 +172,7 @@ class Pano2BA(Tk):
         else:
             title_suffix = '* (Not saved)'
         if self.ScrolledCanvas.zoom_ratio != 1:
-            title_zoom = ' [' + str(self.ScrolledCanvas.zoom_ratio * 100)[:3] + '%]'
+            title_zoom = ' [{:.0f}%]'.format(self.ScrolledCanvas.zoom_ratio * 100)
         else:
             title_zoom = ''
 
@@ -224,18 +218,31 @@ class Pano2BA(Tk):
                             keyword_string = keyword_string.replace('；', ';')
                             keyword_string = keyword_string.replace(' ', ';')
                             if keyword_string == '' or keyword_string == '*':  # input all images
-                                img_dir_list, img_name_list = self._get_all_image_dirs(folder_name, '*')
+                                keywords = '*'
                             else:
                                 keywords = keyword_string.split(';')
-                                img_dir_list, img_name_list = self._get_all_image_dirs(folder_name, keywords)
+                            # scanning is lazy, only the first images are found before asking confirm
+                            img_dirs = self._get_all_image_dirs(folder_name, keywords, skip_dirs=db.get_img_dirs())
+                            img_dir_list = []
+                            img_name_list = []
+                            for img_dir, img_name in islice(img_dirs, self.import_preview_num + 1):
+                                img_dir_list.append(img_dir)
+                                img_name_list.append(img_name)
+                            preview = str(img_name_list[:self.import_preview_num])
+                            if len(img_name_list) > self.import_preview_num:
+                                preview += '\n... and more images still scanning'
 
                             satisfy = askyesnocancel('Import confirm', 'Import all the following images? '
                                                                        '[Yes] to add, [No] to re-input keywords, '
-                                                                       '[Cancel] to stop adding\n'+str(img_name_list))
+                                                                       '[Cancel] to stop adding\n' + preview)
                             if satisfy is None:  # stop adding
                                 ask_keyword = False
                             else:
                                 if satisfy:  # confirm to add
+                                    # finish scanning the rest images
+                                    for img_dir, img_name in img_dirs:
+                                        img_dir_list.append(img_dir)
+                                        img_name_list.append(img_name)
                                     img_mode_choice = askyesnocancel('Default mode Selection',
                                                                      'The default tree marking mode is '
                                                                      'Edge Marking[Yes] or Clicking[No] '
@@ -246,8 +253,8 @@ class Pano2BA(Tk):
                                         img_mode = 1
 
                                     ask_keyword = False
-                                    length = len(img_dir_list)
-                                    for i, img_dir in enumerate(img_dir_list):
+                                    img_mode_list = []
+                                    for img_dir in img_dir_list:
                                         # -----for Lab use only------
                                         if img_mode_choice is None:
                                             if '_r' in os.path.basename(img_dir):
@@ -255,10 +262,11 @@ class Pano2BA(Tk):
                                             else:
                                                 img_mode = 0
                                         # ------for Lab use only------
-                                        db.add_img(img_dir, img_mode)
-                                        self.update_progress(int(100 * i / length))
-                                    self.refresh_img_table()
-                                    self.open_img_project()
+                                        img_mode_list.append(img_mode)
+                                    db.add_imgs(img_dir_list, img_mode_list,
+                                                progress=lambda done, total:
+                                                self.update_progress(int(100 * done / total)))
+                                    self._open_first_img()
                                     self.make_unsaved()
                                     self.update_progress(100)
                         else:  # cancel adding
@@ -282,47 +290,55 @@ class Pano2BA(Tk):
                         img_mode = 1
                     db.add_img(img_dir, img_mode)
                     self.update_progress(50)
-                    self.refresh_img_table()
-                    self.open_img_project()
+                    self._open_first_img()
                     self.update_progress(100)
                     self.make_unsaved()
 
     @staticmethod
-    def _get_all_image_dirs(folder_name, keywords='*'):
-        img_dir_list = []
-        img_name_list = []
-        g = os.walk(folder_name)
-        for path, dir_list, file_list in g:
-            for file_name in file_list:
-                # check whether it is a image file
-                pick = False
-                for suffix in ['.jpg', '.jpeg', '.JPG', '.JPEG', '.png']:
-                    if suffix in file_name:
-                        pick = True
-                if not pick:
-                    continue
-
-                if keywords == '*':  # add all images
-                    img_dir = os.path.join(path, file_name)
-                    img_dir_list.append(img_dir)
-                    img_name_list.append(file_name)
-                else:
-                    include = False
-                    exclude = False
-                    for key in keywords:
-                        if '-' in key:  # exclude keywords
-                            ex_key = key[1:]
-                            if ex_key in file_name:
-                                exclude = True
-                        else:  # include keyword
-                            if key in file_name:
-                                include = True
-                    if include and not exclude:
-                        img_dir = os.path.join(path, file_name)
-                        img_dir_list.append(img_dir)
-                        img_name_list.append(file_name)
-
-        return img_dir_list, img_name_list
+    def _compile_keyword_matcher(keywords='*'):
+        # compile the keyword grammar once: keywords split by ';', '-' before a word to exclude it,
+        # e.g. ['cor', 'rua', '-19'] means name contains 'cor' OR 'rua' but not '19'
+        # return a function(file_name) -> bool
+        if keywords == '*':
+            return lambda file_name: True
+
+        include_keys = [key for key in keywords if key != '' and key[0] != '-']
+        exclude_keys = [key[1:] for key in keywords if key[1:] != '' and key[0:1] == '-']
+        include = re.compile('|'.join(re.escape(key) for key in include_keys)) if include_keys else None
+        exclude = re.compile('|'.join(re.escape(key) for key in exclude_keys)) if exclude_keys else None
+
+        def match(file_name):
+            if include is not None and include.search(file_name) is None:
+                return False
+            if exclude is not None and exclude.search(file_name) is not None:
+                return False
+            return True
+
+        return match
+
+    @staticmethod
+    def _get_all_image_dirs(folder_name, keywords='*', skip_dirs=()):
+        # generator of (img_dir, file_name) under folder_name and its child folders,
+        # yield as soon as found, images already in skip_dirs (the project) are ignored
+        match = Pano2BA._compile_keyword_matcher(keywords)
+        skip_dirs = {os.path.normcase(os.path.normpath(d)) for d in skip_dirs}
+
+        folders = [folder_name]
+        while folders:
+            path = folders.pop()
+            try:
+                entries = list(os.scandir(path))
+            except OSError:  # no permission or removed, same as os.walk
+                continue
+            sub_folders = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_folders.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in ('.jpg', '.jpeg', '.png') and match(entry.name):
+                    if os.path.normcase(os.path.normpath(entry.path)) not in skip_dirs:
+                        yield entry.path, entry.name
+            # keep child folders in listing order (top-down like os.walk)
+            folders.extend(reversed(sub_folders))
 
     def del_img(self):
         selections = self.img_table.selection()
@@ -330,24 +346,29 @@ class Pano2BA(Tk):
 
         rm_img_id_list = []
         rm_img_name_list = []
+        rm_img_dirs = set()
         for iid in selections:
             img_id = int(iid)
-            img_table_row = self.img_info['img_id'].index(img_id)
-            img_name = self.img_info['img_name'][img_table_row]
+            img_name = self.img_info.get(self.img_info.row(img_id), 'img_name')
             rm_img_id_list.append(img_id)
             rm_img_name_list.append(img_name)
+            rm_img_dirs.add(self.img_info.get(self.img_info.row(img_id), 'img_dir'))
 
         self.update_progress(20)
         confirm = askyesno('warning', 'Are you sure to remove the following images?\n' +
                            str(rm_img_name_list) + '\nall tree data in these image will also get lost')
         if confirm:
             for i, img_id in enumerate(rm_img_id_list):
-                db.rm_img(img_id)
+                db.rm_img(img_id)  # the img_table row is removed by on_db_change
                 steps = int(70 * i / length)
                 self.update_progress(20 + steps)
-            self.refresh_img_table()
+            # disk caches of the removed images, unless the same photo is still listed in the project
+            disk_cache = self.ScrolledCanvas.prefetcher.disk_cache
+            if disk_cache is not None:
+                for img_dir in rm_img_dirs - set(self.img_info['img_dir'].tolist()):
+                    disk_cache.remove(img_dir)
             self.update_progress(95)
-            self.open_img_project()
+            self._open_first_img()
             self.make_unsaved()
             self.update_progress(100)
         else:  # cancel remove
@@ -359,15 +380,53 @@ class Pano2BA(Tk):
             if baf is not None:
                 self.update_progress(10)
                 db.edit_img_baf(self.ScrolledCanvas.img_id, baf)
-                self.ScrolledCanvas.baf = baf
-                self.refresh_tree_table()
                 self.update_progress(40)
-                self.local_refresh_img_table(baf)
-                self.update_progress(70)
-                self.ScrolledCanvas.open_img(reload=False, recenter=False)
+                self._show_baf(baf)
                 self.update_progress(100)
                 self.make_unsaved()
+
+    def _show_baf(self, baf):
+        # trees of the current image under its new baf
+        self.ScrolledCanvas.baf = baf
+        if self.mode.get() == 0:
+            # edge mode, only the trees whose in/out state flipped are shown again
+            tree_rows = self.tree_info.change_baf(baf)
+            self.tree_table.refresh([self.tree_info.get(tree_row, 'tree_id') for tree_row in tree_rows])
+            self.ScrolledCanvas.recolour_trees(tree_rows)
+        else:
+            # click mode, clicks are recorded under each baf, another baf is another click set
+            self.refresh_tree_table()
+            self.ScrolledCanvas.open_img(reload=False, recenter=False)
                 
+    def change_band(self, event=None):
+        # band mode, only decode, equalize and show the vertical band around the horizon of this image
+        if self.del_img_btn['state'] == 'normal':  # have data in img_table
+            band = askfloat('Band mode', 'Input the kept band height to the image height\n'
+                                         '(float, 0.1 - 1.0, 1.0 is the whole image):', minvalue=0.1, maxvalue=1.0)
+            if band is not None:
+                self.update_progress(10)
+                db.edit_img_band(self.ScrolledCanvas.img_id, band)
+                self.ScrolledCanvas.img_band = band
+                self.ScrolledCanvas.img_lut = None
+                self._reload_img()
+
+    def change_enhance(self, enhance):
+        # image enhancement method (imgproc.enhance_methods) of this image
+        if self.del_img_btn['state'] == 'normal':  # have data in img_table
+            self.update_progress(10)
+            db.edit_img_enhance(self.ScrolledCanvas.img_id, enhance)
+            self.ScrolledCanvas.img_enhance = enhance
+            self.ScrolledCanvas.img_lut = None
+            self._reload_img()
+
+    def _reload_img(self):
+        # preprocess the current image again after its preprocess options changed
+        self.ScrolledCanvas.zoom_ratio = self.ScrolledCanvas.get_open_zoom_ratio()
+        self.ScrolledCanvas.open_img(reload=True)
+        self.update_progress(100)
+        self.update_title()
+        self.make_unsaved()
+
     def change_baf_all(self, event=None):
         if self.del_img_btn['state'] == 'normal':  # have data in img_table
             if not self.saved:
@@ -385,28 +444,18 @@ class Pano2BA(Tk):
                                     str(baf) + '?\nThis operation can not undo.')
                 if confirm2:
                     db.edit_img_baf_all(baf)
-                    self.refresh_img_table()
-                    self.refresh_tree_table()
-                    self.ScrolledCanvas.open_img(reload=False, recenter=False)
+                    self._show_baf(baf)
                     self.make_unsaved()
 
     def del_tree(self, event=None):
         confirm = askyesno('warning', 'Are you sure to remove selected records?')
         if confirm:
-            selections = self.tree_table.selection()
-            length = len(selections)
-            for i, iid in enumerate(selections):
-                tree_id = int(iid)
-                if self.mode.get() == 0:  # edge mode
-                    db.rm_tree(tree_id)
-                else:   # click mode
-                    db.rm_click(tree_id)
-                steps = int(90 * i / length)
-                self.update_progress(steps)
-            self.refresh_tree_table()
-            self.local_refresh_img_table(baf=self.ScrolledCanvas.baf)
-            self.update_progress(95)
-            self.ScrolledCanvas.open_img(reload=False, recenter=False)
+            tree_ids = [int(iid) for iid in self.tree_table.selection()]
+            # the rows and shapes are removed by on_db_change
+            if self.mode.get() == 0:  # edge mode
+                db.rm_trees(tree_ids)
+            else:   # click mode
+                db.rm_clicks(tree_ids)
             self.update_progress(100)
             self.make_unsaved()
         else:  # cancel remove
@@ -416,104 +465,200 @@ class Pano2BA(Tk):
         selections = self.tree_table.selection()
         if len(selections) == 1:  # select one tree.
             tree_id = int(selections[0])
+            tree_row = self.tree_info.row(tree_id)
             if self.mode.get() == 0:
-                tree_row = self.tree_info['tree_id'].index(tree_id)
-                x1, y1 = self.tree_info['left'][tree_row]
-                x2, y2 = self.tree_info['right'][tree_row]
+                x1, y1 = self.tree_info.get(tree_row, 'lx'), self.tree_info.get(tree_row, 'ly')
+                x2, y2 = self.tree_info.get(tree_row, 'rx'), self.tree_info.get(tree_row, 'ry')
                 center_x = (x1 + x2) / 2 * self.ScrolledCanvas.zoom_ratio
                 center_y = (y1 + y2) / 2 * self.ScrolledCanvas.zoom_ratio
             else:
-                tree_row = self.tree_info['click_id'].index(tree_id)
-                center_x = self.tree_info['x'][tree_row] * self.ScrolledCanvas.zoom_ratio
-                center_y = self.tree_info['y'][tree_row] * self.ScrolledCanvas.zoom_ratio
+                center_x = self.tree_info.get(tree_row, 'x') * self.ScrolledCanvas.zoom_ratio
+                center_y = self.tree_info.get(tree_row, 'y') * self.ScrolledCanvas.zoom_ratio
 
             self.ScrolledCanvas.change_canvas_position(center_x, center_y)
     
-    def local_refresh_img_table(self, baf):
-        # update img_table information
-        selections = self.img_table.selection()
-        if len(selections) == 1:  # not multiple selection
-            img_id = int(selections[0])
-            img_table_row = self.img_info['img_id'].index(img_id)
-            in_tree_num = self.tree_info['state'].count('in')
-            ba = plot_ba_calculator(baf, in_tree_num)
-            self.img_info['baf'][img_table_row] = baf
-            self.img_info['in_num'][img_table_row] = in_tree_num
-            self.img_info['ba'][img_table_row] = ba
-
-            # update img_table
-            values = [self.img_info['img_name'][img_table_row],
-                      self.img_info['baf'][img_table_row],
-                      self.img_info['in_num'][img_table_row],
-                      self.img_info['ba'][img_table_row]]
-            self.img_table.item(img_id, values=values)
+    def on_db_change(self, event, img_ids, ids):
+        # DataBase change events (db.subscribe), only the changed rows are read again and shown,
+        # the whole project is only loaded when opening it (refresh_img_table)
+        if event == 'img_added':
+            added = db.get_img_info(img_ids)
+            for row in range(len(added)):
+                self.img_info.append(**added.values(row))
+            self.img_table.set_ids(self.img_table_ids())
+            self.del_img_btn.config(state='normal')
+        elif event == 'img_removed':
+            self.img_info.remove([img_id for img_id in img_ids if img_id in self.img_info])
+            self.img_table.remove_ids(img_ids)
+            if len(self.img_info) == 0:
+                self._show_empty_project()
+        else:
+            if event != 'img_changed' and self.ScrolledCanvas.img_id in img_ids:
+                self._apply_tree_change(event, ids)
+            # also the in tree number and BA of the images of changed trees
+            changed = db.get_img_info(img_ids)
+            for row in range(len(changed)):
+                values = changed.values(row)
+                if values['img_id'] in self.img_info:
+                    self.img_info.update(self.img_info.row(values['img_id']), **values)
+            if self.img_table.sort_column is None:
+                self.img_table.refresh(img_ids)
+            else:  # baf, in tree number and BA may move the rows
+                self.img_table.set_ids(self.img_table_ids())
+
+    def _apply_tree_change(self, event, tree_ids):
+        # tree (edge mode) or click (click mode) event of the current image
+        kind, change = event.split('_')
+        if (kind == 'tree') != (self.mode.get() == 0):  # records of the other mode, not shown
+            return
+        if change == 'removed':
+            # rm_trees / rm_clicks may also remove the ones of other images in the same event
+            tree_ids = [tree_id for tree_id in tree_ids if tree_id in self.tree_info]
+            tree_rows = self.tree_info.remove(tree_ids)
+            self.tree_table.remove_ids(tree_ids)
+            self.ScrolledCanvas.remove_trees(tree_rows)
+        else:
+            if kind == 'tree':
+                changed = db.get_tree_info(self.ScrolledCanvas.img_id, tree_ids)
+            else:
+                changed = db.get_click_info(self.ScrolledCanvas.img_id, tree_ids)
+            for row in range(len(changed)):
+                if change == 'added':
+                    self.tree_info.append(**changed.values(row))
+                else:
+                    self.tree_info.update(self.tree_info.row(changed.get(row, changed.id_column)),
+                                          **changed.values(row))
+            if self.tree_table.sort_column is not None and self.mode.get() == 0:
+                self.tree_table.set_ids(self.tree_table_ids())  # new or edited trees sorted into place
+            elif change == 'added':
+                self.tree_table.append_ids(changed.ids())
+            else:
+                self.tree_table.refresh(tree_ids)
+        self.del_tree_btn.config(state='normal' if len(self.tree_info) > 0 else 'disabled')
 
     def refresh_img_table(self):
-        # clear table info
-        self.img_table.delete(*self.img_table.get_children())
-        # get image info
+        # get image info, img_table only reads the visible rows of it (img_table_values)
         self.img_info = db.get_img_info()
-        length = len(self.img_info['img_id'])
-        if length > 0:  # have img data
+        self.img_table.set_ids(self.img_table_ids())
+        if len(self.img_info) > 0:  # have img data
             self.del_img_btn.config(state='normal')
-            for i in range(length):
-                img_values = [self.img_info['img_name'][i], self.img_info['baf'][i],
-                              self.img_info['in_num'][i], self.img_info['ba'][i]]
-                self.img_table.insert('', 'end', iid=str(self.img_info['img_id'][i]), values=img_values)
-            self.img_table.selection_set(str(self.img_info['img_id'][0]))
+            if len(self.img_table.ids) > 0:
+                self.img_table.selection_set(str(self.img_table.ids[0]))
         else:  # no img data, empty project
-            self.del_img_btn.config(state='disabled')
-            self.refresh_tree_table()
-            self.ScrolledCanvas.initialize(clean_canvas=True)
+            self._show_empty_project()
+
+    def _show_empty_project(self):
+        self.del_img_btn.config(state='disabled')
+        self.del_tree_btn.config(state='disabled')
+        self.tree_info = TreeStore(self.mode.get())
+        self.tree_table.set_ids([])
+        self.ScrolledCanvas.initialize(clean_canvas=True)
+
+    def _open_first_img(self):
+        # after the current image removed, or the first images added to an empty project
+        if self.ScrolledCanvas.img_id not in self.img_info and len(self.img_table.ids) > 0:
+            self.img_table.selection_set(str(self.img_table.ids[0]))
+            self.open_img_project()
+
+    def img_table_ids(self):
+        # img_id in img_table order, sorted and filtered by sqlite unless neither is asked
+        keyword = self.img_filter.get().strip()
+        if self.img_table.sort_column is None and keyword == '':
+            return self.img_info.ids()
+        order = self.img_order.get(self.img_table.sort_column, 'img_id')
+        return db.get_img_ids(order, self.img_table.descending, keyword)
+
+    def sort_img_table(self, column, descending):
+        return db.get_img_ids(self.img_order[column], descending, self.img_filter.get().strip())
+
+    def filter_img_table(self, event=None):
+        # only the images whose name contains the keyword in img_filter_entry, the selection is kept
+        self.img_table.set_ids(self.img_table_ids())
+
+    def img_table_values(self, img_ids):
+        rows = [self.img_info.row(img_id) for img_id in img_ids]
+        return list(zip(self.img_info['img_name'][rows].tolist(), self.img_info['baf'][rows].tolist(),
+                        self.img_info['in_num'][rows].tolist(), self.img_info['ba'][rows].tolist()))
 
     def refresh_tree_table(self):
-        # clear table info
-        self.tree_table.delete(*app.tree_table.get_children())
-        # get new tree info
+        # get new tree info, tree_table only reads the visible rows of it (tree_table_values)
         if self.mode.get() == 0:
             self.tree_info = db.get_tree_info(self.ScrolledCanvas.img_id)
         else:
             self.tree_info = db.get_click_info(self.ScrolledCanvas.img_id)
+        self.tree_table.set_ids(self.tree_table_ids())
 
-        length = len(self.tree_info['state'])
-
-        if length > 0:  # tree exist
+        if len(self.tree_info) > 0:  # tree exist
             self.del_tree_btn.config(state='normal')
-            for i in range(length):
-                # here start counting tree number (display in tree_table) from 1
-                tree_values = [i+1, self.tree_info['width'][i], self.tree_info['state'][i]]
-                # but the actual tree index start from 0 in software
-                if self.mode.get() == 0:
-                    self.tree_table.insert('', 'end', iid=str(self.tree_info['tree_id'][i]), values=tree_values)
-                else:
-                    self.tree_table.insert('', 'end', iid=str(self.tree_info['click_id'][i]), values=tree_values)
         else:
             self.del_tree_btn.config(state='disabled')
 
+    def tree_table_ids(self):
+        # tree_id in tree_table order, sorted by sqlite if asked, clicks are always in click order
+        if self.tree_table.sort_column is None or self.mode.get() != 0:
+            return self.tree_info.ids()
+        return self.sort_tree_table(self.tree_table.sort_column, self.tree_table.descending)
+
+    def sort_tree_table(self, column, descending):
+        if self.mode.get() != 0:  # all the clicks are the same width and in
+            return self.tree_info.ids()
+        return db.get_tree_ids(self.ScrolledCanvas.img_id, self.tree_order[column], descending)
+
+    def tree_table_values(self, tree_ids):
+        # here start counting tree number (display in tree_table) from 1,
+        # but the actual tree index start from 0 in software
+        rows = [self.tree_info.row(tree_id) for tree_id in tree_ids]
+        widths = self.tree_info['width'][rows].tolist()
+        return [(row + 1, width, self.tree_info.state_name(row)) for row, width in zip(rows, widths)]
+
     def open_img_project(self, event=None, force_fresh=False):
         if self.del_img_btn['state'] == 'normal':  # ensure it is not an empty list
             selections = self.img_table.selection()
             if len(selections) == 1:  # not multiple selection
                 img_id = int(selections[0])
-                img_table_row = self.img_info['img_id'].index(img_id)
+                img_table_row = self.img_info.row(img_id)
                 # check if click on the older one
-                new_img_id = self.img_info['img_id'][img_table_row]
-                if new_img_id != self.ScrolledCanvas.img_id or force_fresh:  # click not the same
-                    self.ScrolledCanvas.img_id = self.img_info['img_id'][img_table_row]
-                    self.ScrolledCanvas.img_dir = self.img_info['img_dir'][img_table_row]
-                    self.ScrolledCanvas.baf = self.img_info['baf'][img_table_row]
-                    self.ScrolledCanvas.img_width = self.img_info['width'][img_table_row]
-                    self.ScrolledCanvas.img_height = self.img_info['height'][img_table_row]
-                    if self.img_info['mode'][img_table_row] == 0:
+                if img_id != self.ScrolledCanvas.img_id or force_fresh:  # click not the same
+                    self.ScrolledCanvas.img_id = img_id
+                    self.ScrolledCanvas.img_dir = self.img_info.get(img_table_row, 'img_dir')
+                    self.ScrolledCanvas.baf = self.img_info.get(img_table_row, 'baf')
+                    self.ScrolledCanvas.img_width = self.img_info.get(img_table_row, 'width')
+                    self.ScrolledCanvas.img_height = self.img_info.get(img_table_row, 'height')
+                    self.ScrolledCanvas.img_band = self.img_info.get(img_table_row, 'band')
+                    self.ScrolledCanvas.img_enhance = self.img_info.get(img_table_row, 'enhance')
+                    self.ScrolledCanvas.img_lut = db.get_img_lut(img_id)
+                    self.MenuBar.enhance.set(self.ScrolledCanvas.img_enhance)
+                    if self.img_info.get(img_table_row, 'mode') == 0:
                         self.mode.set(0)
                     else:
                         self.mode.set(1)
                     self.refresh_tree_table()
                     self.update_progress(30)
-                    self.ScrolledCanvas.zoom_ratio = 1.0
+                    self.ScrolledCanvas.zoom_ratio = self.ScrolledCanvas.get_open_zoom_ratio()
                     self.ScrolledCanvas.open_img(reload=True)
                     self.update_progress(100)
                     self.update_title()
+                    self.prefetch_neighbour_imgs()
+
+    def prefetch_neighbour_imgs(self):
+        # preprocess the images around the current one (in img_table order) while annotating it,
+        # nearest first, the queued ones not around any more are cancelled
+        img_ids = self.img_table.ids
+        if self.ScrolledCanvas.img_id not in self.img_table.position:  # filtered out
+            return
+        current = self.img_table.position[self.ScrolledCanvas.img_id]
+        open_zoom_ratio = self.ScrolledCanvas.get_open_zoom_ratio()
+        img_dirs = []
+        open_options = []
+        for i in range(1, self.prefetch_num + 1):
+            for row in [current + i, current - i]:
+                if 0 <= row < len(img_ids):
+                    img_id = img_ids[row]
+                    img_table_row = self.img_info.row(img_id)
+                    img_dirs.append(self.img_info.get(img_table_row, 'img_dir'))
+                    open_options.append(self.ScrolledCanvas.load_options(
+                        open_zoom_ratio, band=self.img_info.get(img_table_row, 'band'),
+                        enhance=self.img_info.get(img_table_row, 'enhance'), lut=db.get_img_lut(img_id)))
+        self.ScrolledCanvas.prefetcher.prefetch(img_dirs, open_options)
                     
     def show_capslock_warning(self, event=None):
         if event.keysym != "Caps_Lock":
@@ -521,19 +666,11 @@ class Pano2BA(Tk):
 
     def change_selection_mode(self):
         if self.del_img_btn['state'] == 'normal':  # ensure it is not an empty list
-            img_table_row = self.img_info['img_id'].index(self.ScrolledCanvas.img_id)
-            if self.mode.get() == 0:
-                db.edit_img_mode(self.ScrolledCanvas.img_id, 0)
-                self.img_info['mode'][img_table_row] = 0
-                self.tree_info = db.get_tree_info(self.ScrolledCanvas.img_id)
-            else:
-                db.edit_img_mode(self.ScrolledCanvas.img_id, 1)
-                self.img_info['mode'][img_table_row] = 1
-                self.tree_info = db.get_click_info(self.ScrolledCanvas.img_id)
+            # the in tree number of img_table is counted again by on_db_change
+            db.edit_img_mode(self.ScrolledCanvas.img_id, self.mode.get())
 
             # clear canvas and draw images
             self.refresh_tree_table()
-            self.local_refresh_img_table(baf=self.ScrolledCanvas.baf)
             self.ScrolledCanvas.initialize()
             self.ScrolledCanvas.open_img(reload=False)
             self.make_unsaved()
@@ -554,6 +691,8 @@ class MenuBar(Frame):
         self.file.add_command(label='New', command=self.new_project, underline=0)
         self.file.add_command(label='Open', command=self.open_project, underline=1)
         self.file.add_command(label='Save', command=self.save_project, underline=1, state='disabled')
+        self.file.add_separator()
+        self.file.add_command(label='Image cache info', command=self.show_cache_info, underline=0)
         self.fbutton.config(menu=self.file, bg='white')
 
         self.ebutton = Menubutton(self.menubar, text='Export', underline=0, state='disabled')
@@ -563,6 +702,20 @@ class MenuBar(Frame):
         self.export.add_command(label='BAF sequence', command=self.sequence_baf_export, underline=0)
         self.ebutton.config(menu=self.export, bg='white')
 
+        # preprocess options of the current image
+        self.ibutton = Menubutton(self.menubar, text='Image', underline=0, state='disabled')
+        self.ibutton.pack(side='left')
+        self.image = Menu(self.ibutton, tearoff=False)
+        self.enhance = StringVar()
+        self.enhance.set('equalize')
+        for label, enhance in [('Histogram equalization', 'equalize'), ('Gamma', 'gamma'),
+                               ('Contrast stretch', 'stretch'), ('No enhancement', 'none')]:
+            self.image.add_radiobutton(label=label, variable=self.enhance, value=enhance,
+                                       command=self.change_enhance)
+        self.image.add_separator()
+        self.image.add_command(label='Band mode', command=self.change_band, underline=0)
+        self.ibutton.config(menu=self.image, bg='white')
+
     def new_project(self, event=None):
         ans = True
         if not app.saved:
@@ -589,16 +742,16 @@ class MenuBar(Frame):
                 app.update_progress(50)
 
                 db.create_db(project_dir)
+                app.ScrolledCanvas.set_disk_cache(project_dir)
                 if os.path.exists('~$default.sqlite'):
                     os.remove('~$default.sqlite')
                 app.update_progress(70)
 
-                app.img_table.delete(*app.img_table.get_children())
-                app.tree_table.delete(*app.tree_table.get_children())
-                app.ScrolledCanvas.initialize(clean_canvas=True)
+                app.refresh_img_table()
 
                 self.file.entryconfigure('Save', state="normal")
                 self.ebutton.config(state='normal')
+                self.ibutton.config(state='normal')
                 app.update_progress(100)
 
     def open_project(self, event=None):
@@ -618,21 +771,22 @@ class MenuBar(Frame):
             former_db_path = db.db_path
             db.change_db(project_dir)
             # check if is the pano2ba project db
-            db.curs.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            table_columns = db.curs.fetchall()
+            table_names = db.get_table_names()
             app.update_progress(5)
-            if table_columns == [('ImageInfo',), ('TreeInfo',)]:
+            if table_names == {'ImageInfo', 'TreeInfo'}:
                 db.update_db()
                 showinfo('Update', 'Detect older version database, updated successfully')
-                db.curs.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                table_columns = db.curs.fetchall()
+                table_names = db.get_table_names()
 
-            if table_columns == [('ImageInfo',), ('TreeInfo',), ('ClickInfo',)]:
+            if table_names == {'ImageInfo', 'TreeInfo', 'ClickInfo'}:
+                db.update_db()  # silently add the table index and rowid ids missing in older projects
                 app.add_img_btn.config(state='normal')
                 self.file.entryconfigure('Save', state="normal")
                 self.ebutton.config(state='normal')
+                self.ibutton.config(state='normal')
                 app.title_name = project_dir[:20] + '...' + project_dir[-30:]
                 app.update_title()
+                app.ScrolledCanvas.set_disk_cache(project_dir)
                 app.update_progress(10)
 
                 if os.path.exists('~$default.sqlite'):
@@ -659,6 +813,30 @@ class MenuBar(Frame):
             app.update_title()
             app.update_progress(100)
 
+    @staticmethod
+    def show_cache_info():
+        # hit / miss statistics used to size ScrolledCanvas.image_cache_budget
+        stats = app.ScrolledCanvas.image_cache.stats()
+        # and how the current image was preprocessed
+        timings = ', '.join('{} {:.0f}ms'.format(step, seconds * 1000)
+                            for step, seconds in app.ScrolledCanvas.load_timings.items())
+        showinfo('Image cache', 'Cached images: {images}\n'
+                                'Memory: {mb:.0f} / {budget_mb:.0f} MB\n'
+                                'Hits: {hits}, Misses: {misses} (hit rate {rate:.0%})\n'
+                                'Evictions: {evictions}\n\n'
+                                'Current image ({enhance}): {timings}'.format(mb=stats['nbytes'] / 1024 ** 2,
+                                                                budget_mb=stats['budget'] / 1024 ** 2,
+                                                                rate=stats['hit_rate'],
+                                                                enhance=app.ScrolledCanvas.img_enhance,
+                                                                timings=timings or '-', **stats))
+
+    def change_enhance(self):
+        app.change_enhance(self.enhance.get())
+
+    @staticmethod
+    def change_band():
+        app.change_band()
+
     @staticmethod
     def default_baf_export():
         save_path = asksaveasfilename(title='export data', defaultextension=".xls",
@@ -671,7 +849,7 @@ class MenuBar(Frame):
             click_info = wb.add_sheet(sheetname='Click Info')
 
             # plot info
-            img_data = app.img_info
+            img_data = app.img_info.to_dict()  # columns as python lists, xlwt does not write numpy values
             img_length = len(img_data['img_id'])
             img_title = ['Image ID', 'Image Name', 'BAF', 'In Tree Number', 'BA']
             for i, name in enumerate(img_title):
@@ -685,7 +863,7 @@ class MenuBar(Frame):
                 app.update_progress(10 + 30 * i / img_length)
 
             # tree_info
-            tree_data = db.get_tree_info_all()
+            tree_data = db.get_tree_info_all().to_dict()
             tree_length = len(tree_data['tree_id'])
             tree_title = ['Tree ID', 'Image ID', 'Tree Width Pixel', 'Max BAF']
             for i, name in enumerate(tree_title):
@@ -698,7 +876,7 @@ class MenuBar(Frame):
                 app.update_progress(40 + 30 * i / tree_length)
 
             # click_info
-            click_data = db.get_click_info_all()
+            click_data = db.get_click_info_all().to_dict()
             click_length = len(click_data['click_id'])
             click_title = ['img_id','click_id','x','y','BAF']
             for i, name in enumerate(click_title):
@@ -769,7 +947,7 @@ class MenuBar(Frame):
                 app.update_progress(10 + 30 * i / img_length)
 
             # tree_info
-            tree_data = db.get_tree_info_all()
+            tree_data = db.get_tree_info_all().to_dict()
             tree_length = len(tree_data['tree_id'])
             tree_title = ['Tree ID', 'Image ID', 'Tree Width Pixel', 'Max BAF']
             for i, name in enumerate(tree_title):
@@ -782,7 +960,7 @@ class MenuBar(Frame):
                 app.update_progress(40 + 30 * i / tree_length)
 
             # click_info
-            click_data = db.get_click_info_all()
+            click_data = db.get_click_info_all().to_dict()
             click_length = len(click_data['click_id'])
             click_title = ['img_id', 'click_id', 'x', 'y', 'BAF']
             for i, name in enumerate(click_title):
@@ -812,11 +990,11 @@ class ScrolledCanvas(Frame):
 
     # default, point1 is left, point2 is right, r is id for reference bar
     ## edge mode
-    shape_ids = {'point1': [], 'line': [], 'point2': [], 'text': [], 'canvas_img': None, 'r': None}
+    shape_ids = {'point1': [], 'line': [], 'point2': [], 'text': [], 'r': None}
     moving = {'fixed_p': [0, 0], 'line': 'line_id', 'move_p': 'point_id',
               'text': 'text_id', 'tree_row': 0, 'which': 0}
     ## click mode
-    click_ids = {'point':[], 'text':[], 'canvas_img':None, 'r':None}
+    click_ids = {'point':[], 'text':[], 'r':None}
     moving_cmode = {'move_p':'point_id', 'text':'text_id', 'tree_row':0}
 
     # record current img
@@ -825,8 +1003,50 @@ class ScrolledCanvas(Frame):
     baf = 2
     img_width = 1000
     img_height = 800
-    save_image = None  # preprocess photos = PIL.Image()
-    save_photo = None  # zoomed photo shows in canvas = tk.PhotoImage()
+    img_band = 1.0  # band mode, the kept vertical band (ratio of img_height) around horizon, 1.0 is the whole image
+    band_top = 0  # band top row and height in full image pixels, canvas coordinates are still of the full image
+    band_height = 800
+    img_enhance = 'equalize'  # imgproc.enhance_methods of the current image
+    img_lut = None  # its enhancement lookup table, saved in the project once computed
+    load_timings = {}  # preprocessing steps of the current image = {step: seconds}
+    save_image = None  # preprocess photos = PIL.Image(), maybe decoded at a reduced scale
+    load_scale = 1.0  # save_image size to the full image size
+    open_zoom_ratio = 0.4  # default overview zoom when opening an image, only decodes the pixels it needs
+    save_pyramid = None  # downsampled levels of save_image = [(ratio, PIL.Image()), ...]
+    zoom_cache = {}  # resized save_image of visited zoom ratios (<= 1.0) = {ratio: PIL.Image()}
+    zoom_loading = None  # (zoom_ratio, save_pyramid) being resized in background by _load_zoomed_img
+    # the zoomed image is shown by tiles only around the visible region
+    tile_size = 512
+    tile_margin = 1  # tiles kept outside the visible region in each direction
+    tiles = {}  # {(col, row): (canvas_item_id, tk.PhotoImage())}
+    tile_refresh_job = None  # after_idle id of the pending tile refresh
+    view_width = 10  # zoomed image (band) size = scrollregion
+    view_height = 10
+    view_top = 0  # zoomed band top
+    max_zoom_ratio = 8.0
+    image_cache_budget = 1024 ** 3  # bytes of preprocessed images kept in memory (current and prefetched)
+    image_cache_pyramid = True  # also keep pyramid levels in cache (+1/3 memory), or rebuild them
+    # the project disk cache (<project>_cache/) is read if warmed by 'python imgproc.py project.sqlite',
+    # the opened and prefetched images are only saved into it if disk_cache_write, up to disk_cache_budget
+    disk_cache_write = False
+    disk_cache_budget = 10 * 1024 ** 3
+    preprocess_options = default_options  # imgproc.preprocess_image() options, part of the cache key
+    # images are preprocessed in loader threads, results come back by load_queue polled with after()
+    load_tokens = {}  # {kind: token}, +1 by each job of this kind, results of the older tokens are dropped
+    load_futures = {}  # {kind: the latest Future}
+    load_polling = False
+    load_poll_interval = 20  # ms
+    # zoom shows a nearest neighbour preview at once, the high quality image after zoom_refine_delay
+    # without another zoom step
+    zoom_refine_job = None
+    zoom_refine_delay = 150  # ms
+    preview = None  # (canvas_item_id, tk.PhotoImage()) of the zoom preview
+    tree_tag = 'tree'  # canvas tag of all the tree shapes (lines, points, octagons and texts)
+    point_radius = 5  # edge points are drawn as images, keeping the size when tree shapes zoomed by canvas.scale
+    # points (edge points or click octagons) under cursor are found by point_grid (image coordinates),
+    # keys are the canvas ids, point_rows = {canvas id: (tree_row, 1 for left / 2 for right / 0 for click)}
+    point_grid = None
+    point_rows = {}
 
     min_width = in_tree_pixel(1, img_width) * zoom_ratio
     r_pixel = (in_tree_pixel(baf, img_width) * zoom_ratio) / 2
@@ -841,8 +1061,9 @@ class ScrolledCanvas(Frame):
         self.canvas.config(borderwidth=0, bg='white')
         self.vbar.config(command=self.canvas.yview, bg='white')  # scroll steps
         self.hbar.config(command=self.canvas.xview, bg='white')
-        self.canvas.config(yscrollcommand=self.vbar.set)  # canvas steps
-        self.canvas.config(xscrollcommand=self.hbar.set)
+        self.canvas.config(yscrollcommand=self._on_yscroll)  # canvas steps
+        self.canvas.config(xscrollcommand=self._on_xscroll)
+        self.canvas.bind('<Configure>', self._schedule_tiles)
         self.canvas.bind('<ButtonPress-1>', self.left_click)
         self.canvas.bind('<B1-Motion>', self.hold_move_mouse)
         self.canvas.bind('<Motion>', self.move_mouse)
@@ -857,10 +1078,16 @@ class ScrolledCanvas(Frame):
         self.hbar.pack(side='bottom', fill='x')
         self.canvas.pack(side='top', fill='both', expand='yes')
 
-        imarray = ones((10, 10, 3)) * 255
-        im = Image.fromarray(imarray.astype('uint8')).convert("RGBA")
-        photo_im = PhotoImage(im)
-        self.shape_ids['canvas_img'] = self.canvas.create_image(0, 0, image=photo_im, anchor='nw')
+        self.tiles = {}
+        self.image_cache = ImageCache(self.image_cache_budget, keep_pyramid=self.image_cache_pyramid)
+        self.prefetcher = Prefetcher(self.image_cache, write_disk_cache=self.disk_cache_write)
+        self.loader = ThreadPoolExecutor(max_workers=2)  # a new image never waits for a stale one
+        self.load_queue = Queue()
+        self.load_tokens = {}
+        self.load_futures = {}
+        self.point_marker = self._make_point_marker()
+        self.point_grid = PointGrid()
+        self.point_rows = {}
         self.shape_ids['r'] = self.canvas.create_rectangle(0, 0, 5, 5, fill='white',
                                                            outline='black', state='hidden')
         self.click_ids['r'] = self.canvas_create_octagon(self.img_width / 2, self.img_height / 2,
@@ -904,19 +1131,53 @@ class ScrolledCanvas(Frame):
 
 
         if clean_canvas:
+            self._drop_loads()
+            self.zooming = False
             self.img_id = -1
             self.img_dir = ''
             self.baf = 2
             self.img_width = 1000
             self.img_height = 800
+            self.img_band = 1.0
+            self.band_top = 0
+            self.band_height = 800
+            self.img_enhance = 'equalize'
+            self.img_lut = None
+            self.load_timings = {}
             self.save_image = None
-            self.save_photo = None
-
-            imarray = ones((10, 10, 3)) * 255
-            im = Image.fromarray(imarray.astype('uint8')).convert("RGBA")
-            self.save_photo = PhotoImage(im)
+            self.load_scale = 1.0
+            self.save_pyramid = None
+            self.zoom_cache = {}
+            self.view_width = 10
+            self.view_height = 10
+            self.view_top = 0
             self._update_img()
 
+    def set_disk_cache(self, db_path):
+        # equalized previews are also saved next to the project file for later sessions
+        self.prefetcher.disk_cache = DiskCache(DiskCache.cache_dir_of(db_path), self.disk_cache_budget)
+
+    def get_open_zoom_ratio(self):
+        # open_zoom_ratio, but still enough to fill the canvas (same limit as zoom)
+        zoom_ratio = self.open_zoom_ratio
+        while zoom_ratio < 1.0 and not self.fill_canvas(zoom_ratio):
+            zoom_ratio = round(zoom_ratio + 0.2, 1)
+        return zoom_ratio
+
+    def fill_canvas(self, zoom_ratio):
+        # the zoomed image can not be smaller than the canvas,
+        # except the height in band mode, the band is allowed to be lower than the canvas
+        if self.img_width * zoom_ratio < self.canvas.winfo_width():
+            return False
+        return self.img_band < 1.0 or self.img_height * zoom_ratio >= self.canvas.winfo_height()
+
+    def load_options(self, zoom_ratio, **img_options):
+        # preprocess options decoding just enough pixels for zoom_ratio,
+        # of the current image (band, enhance, lut) unless given in img_options
+        options = dict(self.preprocess_options, band=self.img_band, enhance=self.img_enhance, lut=self.img_lut)
+        options.update(img_options, scale=draft_scale(zoom_ratio))
+        return options
+
     def open_img(self, reload=True, recenter=True):
         # step0: clear canvas
         # step1: load image and image equalization
@@ -925,72 +1186,34 @@ class ScrolledCanvas(Frame):
         self.initialize(clean_canvas=False)
         app.update_progress(45)
 
-        # step 0
+        # step 0: the image is loaded in background and shown when ready (_show_loaded_img),
+        # the canvas size only depends on image size and band, trees can be drawn now
         if reload:
-            self._preprocess_img()
+            self._drop_loads()
+            self.zooming = False
+            self.save_image = None
+            self.band_top, band_bottom = band_rows(self.img_height, self.img_band)
+            self.band_height = band_bottom - self.band_top
+            self._load_img(self._show_loaded_img)
             app.update_progress(60)
             self._resize_img()
             app.update_progress(70)
             self._update_img()
 
         if recenter:
-            self.change_canvas_position(0, self.save_photo.height() / 2)
+            self.change_canvas_position(0, self.view_top + self.view_height / 2)
 
         # step 1
         app.update_progress(80)
 
         # step 3: draw trees
-        if app.mode.get() == 0:
-            tree_num = len(app.tree_info['tree_id'])
-            for tree_row in range(tree_num):
-                x1, y1 = app.tree_info['left'][tree_row]
-                x2, y2 = app.tree_info['right'][tree_row]
-                x1 *= self.zoom_ratio
-                y1 *= self.zoom_ratio
-                x2 *= self.zoom_ratio
-                y2 *= self.zoom_ratio
-                if app.tree_info['state'][tree_row] == 'out':
-                    line = self.canvas.create_line(x1, y1, x2, y2, fill='red', width=3)
-                else:
-                    line = self.canvas.create_line(x1, y1, x2, y2, fill='blue', width=3)
-                point1 = self.canvas.create_oval(x1 - 5, y1 - 5, x1 + 5, y1 + 5, fill='yellow', outline='black')
-                point2 = self.canvas.create_oval(x2 - 5, y2 - 5, x2 + 5, y2 + 5, fill='yellow', outline='black')
-                text_x = (x1 + x2) / 2
-                text_y = (y1 + y2) / 2
-                text = self.canvas.create_text(text_x, text_y, text=str(tree_row+1),
-                                               fill='yellow', font=('Times', '12', 'bold'))
-
-                self.shape_ids['point1'].append(point1)
-                self.shape_ids['point2'].append(point2)
-                self.shape_ids['line'].append(line)
-                self.shape_ids['text'].append(text)
-
-                progress = 20 * (tree_row / tree_num)
-                app.update_progress(80 + progress)
-        else:
-            # tree_info = {'click_id': [], 'x':[], 'y':[], 'width':[], 'state':[]}
-            tree_num = len(app.tree_info['click_id'])
-            for tree_row in range(tree_num):
-                x = app.tree_info['x'][tree_row] * self.zoom_ratio
-                y = app.tree_info['y'][tree_row] * self.zoom_ratio
-
-                octagon = self.canvas_create_octagon(x, y, fill='white', outline='black')
-                text = self.canvas.create_text(x, y, text=str(tree_row + 1), fill='black',
-                                               font=('Times', '12', 'bold'))
-
-                # click_ids = {'point':[], 'text':[], 'canvas_img':None, 'r':None}
-                self.click_ids['point'].append(octagon)
-                self.click_ids['text'].append(text)
-
-                progress = 20 * (tree_row / tree_num)
-                app.update_progress(80 + progress)
-
+        self._draw_trees()
 
     def change_canvas_position(self, center_x=None, center_y=None):
         canvas_width = self.canvas.winfo_width()
         canvas_height = self.canvas.winfo_height()
-        img_width = self.save_photo.width()
-        img_height = self.save_photo.height()
+        img_width = self.view_width
+        img_height = self.view_height
 
         if center_x is not None:
             x = (center_x - 0.5 * canvas_width) / img_width
@@ -998,7 +1221,7 @@ class ScrolledCanvas(Frame):
             self.canvas.xview_moveto(final_x)
 
         if center_y is not None:
-            y = (center_y - 0.5 * canvas_height) / img_height
+            y = (center_y - self.view_top - 0.5 * canvas_height) / img_height
             final_y = min(max(0, y), 1)
             self.canvas.yview_moveto(final_y)
 
@@ -1022,65 +1245,37 @@ class ScrolledCanvas(Frame):
     #  functions used inside
     # =======================
     @staticmethod
-    def top_iteration(n, x, y, r):
-        angle = [pi / 16 + 2 * pi * (i / n)  for i in range(n)]
-        for a in angle:
-            yield x + r * cos(a)
-            yield y + r * sin(a)
-
-    def canvas_create_octagon(self, x, y, fill='white', outline='yellow', stipple='', state='normal', mode='oct'):
+    def octagon_coords(x, y, r, mode='oct'):
         #      H--|--A
         #   G /   |o  \ B
         #  --|----|----|--
         #   F \   |   / C
         #      E--|--D
         #
-        # O (x, y)
-
-        r = self.r_pixel
-
+        # O (x, y), r is the inscribed radius, mode='oct' for the octagon, else a 16-gon
+        # return vertices [xa, ya, xb, yb, ...], x and y can also be arrays, one row of vertices for each
         if mode == 'oct':
-            e = 2 / (sqrt(2) + 1) * r
-            xa = xd = x + 0.5 * e
-            ya = yh = y + r
-            xb = xc = x + r
-            yb = yg = y + 0.5 * e
-            yc = yf = y - 0.5 * e
-            yd = ye = y - r
-            xe = xh = x - 0.5 * e
-            xf = xg = x - r
-
-            oct = self.canvas.create_polygon(xa, ya, xb, yb, xc, yc, xd, yd, xe, ye, xf, yf, xg, yg, xh, yh, xa, ya,
-                                             fill=fill, outline=outline, state=state, stipple=stipple)
+            e = 2 / (sqrt(2) + 1) * r  # edge length
+            dx = array([0.5 * e, r, r, 0.5 * e, -0.5 * e, -r, -r, -0.5 * e, 0.5 * e])
+            dy = array([r, 0.5 * e, -0.5 * e, -r, -r, -0.5 * e, 0.5 * e, r, r])
         else:
-            R = r / cos(pi / 16)
-            top = list(self.top_iteration(16, x, y, R))
-            oct = self.canvas.create_polygon(*top, fill=fill, outline=outline, state=state, stipple=stipple)
-            #oct = self.canvas.create_oval(x - r, y - r, x + r, y + r, fill='LightBlue',
-            #                              outline='yellow', state=state, stipple="gray12")
-
-        return oct
+            angle = pi / 16 + 2 * pi * arange(16) / 16
+            dx = r / cos(pi / 16) * cos(angle)
+            dy = r / cos(pi / 16) * sin(angle)
+        x = asarray(x, dtype=float)[..., None]
+        y = asarray(y, dtype=float)[..., None]
+        coords = empty(x.shape[:-1] + (2 * len(dx),))
+        coords[..., 0::2] = x + dx
+        coords[..., 1::2] = y + dy
+        return coords
+
+    def canvas_create_octagon(self, x, y, fill='white', outline='yellow', stipple='', state='normal', mode='oct',
+                              tags=()):
+        return self.canvas.create_polygon(*self.octagon_coords(x, y, self.r_pixel, mode).tolist(), fill=fill,
+                                          outline=outline, state=state, stipple=stipple, tags=tags)
 
     def canvas_coords_octagon(self, oct_id, x, y, mode="oct"):
-
-        r = self.r_pixel
-
-        if mode == 'oct':
-            e = 2 / (sqrt(2) + 1) * r
-            xa = xd = x + 0.5 * e
-            ya = yh = y + r
-            xb = xc = x + r
-            yb = yg = y + 0.5 * e
-            yc = yf = y - 0.5 * e
-            yd = ye = y - r
-            xe = xh = x - 0.5 * e
-            xf = xg = x - r
-
-            self.canvas.coords(oct_id, [xa, ya, xb, yb, xc, yc, xd, yd, xe, ye, xf, yf, xg, yg, xh, yh, xa, ya])
-        else:
-            R = r / cos(pi / 16)
-            top = list(self.top_iteration(16, x, y, R))
-            self.canvas.coords(oct_id, top)
+        self.canvas.coords(oct_id, self.octagon_coords(x, y, self.r_pixel, mode).tolist())
 
     # --------------
     #  mouse events
@@ -1094,13 +1289,11 @@ class ScrolledCanvas(Frame):
                 if not self.add_tree_lock:  # click for the first time
                     number = len(self.shape_ids['point1'])
 
-                    line = self.canvas.create_line(x, y, x, y, fill='red', width=3)
-                    point1 = self.canvas.create_oval(x - 5, y - 5, x + 5, y + 5,
-                                                     fill='yellow', outline='black')
-                    point2 = self.canvas.create_oval(x - 5, y - 5, x + 5, y + 5,
-                                                     fill='yellow', outline='black')
-                    text = self.canvas.create_text(x, y, text=str(number + 1),
-                                                   fill='yellow', font=('Times', '12', 'bold'))
+                    line = self.canvas.create_line(x, y, x, y, fill='red', width=3, tags=self.tree_tag)
+                    point1 = self.canvas.create_image(x, y, image=self.point_marker, tags=self.tree_tag)
+                    point2 = self.canvas.create_image(x, y, image=self.point_marker, tags=self.tree_tag)
+                    text = self.canvas.create_text(x, y, text=str(number + 1), fill='yellow',
+                                                   font=('Times', '12', 'bold'), tags=self.tree_tag)
 
                     self.moving['fixed_p'] = [x, y]
                     self.moving['line'] = line
@@ -1132,9 +1325,9 @@ class ScrolledCanvas(Frame):
 
                 number = len(self.click_ids['point'])
                 point = self.canvas_create_octagon(x, y, fill='white', outline='black',
-                                                   state='normal', stipple='')
+                                                   state='normal', stipple='', tags=self.tree_tag)
                 text = self.canvas.create_text(x, y, text=str(number + 1), fill='black',
-                                               font=('Times', '12', 'bold'))
+                                               font=('Times', '12', 'bold'), tags=self.tree_tag)
 
                 self.click_ids['point'].append(point)
                 self.click_ids['text'].append(text)
@@ -1162,23 +1355,21 @@ class ScrolledCanvas(Frame):
         y = self.canvas.canvasy(event.y)
         if not self.add_tree:  # make sure not in adding tree mode
             if not self.move_point:  # find new points
-                id_touched = event.widget.find_closest(x, y, halo=5)
-                if id_touched:  # except canvas empty get nothing
+                # the nearest point within the marker size (canvas pixels) in image coordinates
+                radius = self.point_radius if app.mode.get() == 0 else self.r_pixel + 5
+                id_touched = self.point_grid.nearest(x / self.zoom_ratio, y / self.zoom_ratio,
+                                                     radius / self.zoom_ratio)
+                if id_touched is not None:
                     if app.mode.get() == 0:  # edge mode
-                        ## not touch the line and text item
-                        if id_touched[0] in self.shape_ids['point1'] or id_touched[0] in self.shape_ids['point2']:
-                            [center_x, center_y] = self._get_shape_center(id_touched[0])
-                            if (center_x - x) ** 2 + (center_y - y) ** 2 <= 25:  # make sure touch in points
-                                # find which tree record it belongs to
-                                self._pick_moving_ids(id_touched[0])
-                                self._update_shape_info(x, y)
-                                self.move_point = True
+                        # find which tree record it belongs to
+                        self._pick_moving_ids(id_touched)
+                        self._update_shape_info(x, y)
+                        self.move_point = True
                     else:    # click mode
-                        if id_touched[0] in self.click_ids['point']:
-                            self.canvas.itemconfigure(id_touched[0], outline='yellow', stipple='gray12')
-                            self._pick_moving_ids(id_touched[0])
-                            self._update_shape_info_cmode(x, y)
-                            self.move_point = True
+                        self.canvas.itemconfigure(id_touched, outline='yellow', stipple='gray12')
+                        self._pick_moving_ids(id_touched)
+                        self._update_shape_info_cmode(x, y)
+                        self.move_point = True
 
             else:  # is moving former points, keep updating is enough
                 if app.mode.get() == 0:
@@ -1193,10 +1384,10 @@ class ScrolledCanvas(Frame):
             x = self.canvas.canvasx(event.x)
             y = self.canvas.canvasy(event.y)
             if app.mode.get() == 0:
-                self._update_tree_infos(app.tree_info['tree_id'][self.moving['tree_row']],
+                self._update_tree_infos(app.tree_info.get(self.moving['tree_row'], 'tree_id'),
                                         x0, y0, x, y, mode='edit')
             else:
-                self._update_tree_infos_cmode(app.tree_info['click_id'][self.moving_cmode['tree_row']],
+                self._update_tree_infos_cmode(app.tree_info.get(self.moving_cmode['tree_row'], 'click_id'),
                                               x, y, mode='edit')
                 self.canvas.itemconfigure(self.moving_cmode['move_p'], outline='black', stipple='')
             self.move_point = False
@@ -1265,35 +1456,62 @@ class ScrolledCanvas(Frame):
             if not self.add_tree_lock:
                 rate = 0.2 if event.delta > 0 else -0.2
                 zoom_rate = round(self.zoom_ratio + rate, 1)
-                if zoom_rate + 0.2 > 2.5:
-                    self.zoom_ratio = 2.4
+                if zoom_rate > self.max_zoom_ratio:
                     app.update_title()
                 else:
-                    canvas_width = self.canvas.winfo_width()
-                    canvas_height = self.canvas.winfo_height()
-                    img_width, img_height = self.save_image.size
-                    if img_width * zoom_rate < canvas_width or img_height * zoom_rate < canvas_height:
+                    if not self.fill_canvas(zoom_rate):
                         # can't small any more
                         app.update_title()
                     else:  # proper zoom operation
-                        app.update_progress(10)
                         self.zooming = True
-                        self.zoom_ratio = zoom_rate
-                        self._update_r_pixel()
+                        self._preview_zoom(zoom_rate, event.x, event.y)
                         app.update_title()
+                        # rapid zoom steps only refine the last one
+                        if self.zoom_refine_job is not None:
+                            self.after_cancel(self.zoom_refine_job)
+                        self.zoom_refine_job = self.after(self.zoom_refine_delay, self.refresh_zoomed_image)
 
-    def refresh_zoomed_image(self, event):
+    def refresh_zoomed_image(self, event=None):
+        # replace the zoom preview by the high quality image, at once when releasing Ctrl
         if self.zooming:
-            self._resize_img()
-            app.update_progress(50)
-            self._update_img()
-            app.update_progress(80)
-            self._zoom_shapes()
-            app.update_progress(90)
-            app.update_title()
-            app.update_progress(100)
-            self.change_canvas_position(center_y=self.img_height / 2 * self.zoom_ratio)
+            if self.zoom_refine_job is not None:
+                self.after_cancel(self.zoom_refine_job)
+                self.zoom_refine_job = None
             self.zooming = False
+            if self.zoom_ratio > self.load_scale:  # decode the full resolution only when needed
+                self._load_img(self._show_loaded_img)
+            if self.zoom_ratio <= 1.0 and self.zoom_ratio not in self.zoom_cache:
+                # the preview stays until the zoomed image resized in background
+                if self.zoom_ratio <= self.load_scale:
+                    self._load_zoomed_img()
+            else:  # zoom in tiles are resampled one by one, cheap enough in tk thread
+                self._update_img()
+            app.update_title()
+
+    def _preview_zoom(self, zoom_ratio, x, y):
+        # zoom at once keeping the image point under cursor (x, y), only a nearest neighbour
+        # resample of the visible region from the nearest pyramid level is shown
+        scale = zoom_ratio / self.zoom_ratio
+        left = self.canvas.canvasx(x) * scale - x
+        top = self.canvas.canvasy(y) * scale - y
+        self.zoom_ratio = zoom_ratio
+        self._update_r_pixel()
+        self._resize_img()
+        self._update_img()
+        self._zoom_shapes(scale)
+        self.canvas.xview_moveto(left / self.view_width)
+        self.canvas.yview_moveto((top - self.view_top) / self.view_height)
+
+        if self.save_image is not None:
+            x0 = max(0, int(self.canvas.canvasx(0)))
+            y0 = max(0, int(self.canvas.canvasy(0)) - self.view_top)  # band coordinates
+            box = (x0, y0, min(x0 + self.canvas.winfo_width(), self.view_width),
+                   min(y0 + self.canvas.winfo_height(), self.view_height))
+            if box[2] > box[0] and box[3] > box[1]:
+                photo = PhotoImage(render_tile(self.save_pyramid, zoom_ratio, box, resample=Image.NEAREST))
+                item = self.canvas.create_image(box[0], self.view_top + box[1], image=photo, anchor='nw')
+                self.canvas.tag_lower(item)
+                self.preview = (item, photo)
 
     # ------------------
     #  reused functions
@@ -1312,78 +1530,34 @@ class ScrolledCanvas(Frame):
             my = fy
         if mode == 'add':
             # consider zoom_ratio
-            tree_id, width, baf_max = db.add_tree(img_id=tree_img_id, lx=fx, ly=fy, rx=mx, ry=my, return_value=True)
-            if baf_max >= self.baf:
-                state = 'in'
-            else:
-                state = 'out'
-
-            # add records to tree_table
-            app.tree_info['tree_id'].append(tree_id)
-            app.tree_info['left'].append([fx, fy])
-            app.tree_info['right'].append([mx, my])
-            app.tree_info['width'].append(width)
-            app.tree_info['state'].append(state)
-
-            length = len(app.tree_info['tree_id'])
-
-            if app.del_tree_btn['state'] == 'disabled':  # tree exist
-                app.del_tree_btn.config(state='normal')
-
-            tree_values = [length, width, state]
-            app.tree_table.insert('', 'end', iid=str(tree_id), values=tree_values)
+            # the tree_info and tree_table rows are added by app.on_db_change
+            tree_id = db.add_tree(img_id=tree_img_id, lx=fx, ly=fy, rx=mx, ry=my, return_value=True,
+                                  img_width=self.img_width)[0]
+            tree_row = app.tree_info.row(tree_id)
+            self._index_point(self.shape_ids['point1'][-1], tree_row, 1, fx, fy)
+            self._index_point(self.shape_ids['point2'][-1], tree_row, 2, mx, my)
 
         else:  # mode=='edit'
-            tree_row = self.moving['tree_row']
             if self.moving['which'] == 1:  # move the left(point1)
-                app.tree_info['left'][tree_row] = [mx, my]
-                width, baf_max = db.edit_tree(tree_id=tree_img_id, lx=mx, ly=my, rx=fx, ry=fy, return_value=True)
+                db.edit_tree(tree_id=tree_img_id, lx=mx, ly=my, rx=fx, ry=fy, img_width=self.img_width)
             else:  # move the right(point2)
-                app.tree_info['right'][tree_row] = [mx, my]
-                width, baf_max = db.edit_tree(tree_id=tree_img_id, lx=fx, ly=fy, rx=mx, ry=my, return_value=True)
-
-            if baf_max >= self.baf:
-                state = 'in'
-            else:
-                state = 'out'
-
-            app.tree_info['width'][tree_row] = width
-            app.tree_info['state'][tree_row] = state
-
-            tree_values = [tree_row + 1, width, state]
-            app.tree_table.item(str(app.tree_info['tree_id'][tree_row]), values=tree_values)
-            
-        app.local_refresh_img_table(self.baf)
+                db.edit_tree(tree_id=tree_img_id, lx=fx, ly=fy, rx=mx, ry=my, img_width=self.img_width)
+            self.point_grid.move(self.moving['move_p'], mx, my)
 
     def _update_tree_infos_cmode(self, tree_img_id, x, y, mode='add'):
         mx = x / self.zoom_ratio  # moved_x
         my = y / self.zoom_ratio
 
         if mode == 'add':   # add click point mode
-            click_id, width = db.add_click(img_id=tree_img_id, x=mx, y=my, return_value=True)
-
-            # add records to tree_table
-            app.tree_info['click_id'].append(click_id)
-            app.tree_info['x'].append(mx)
-            app.tree_info['y'].append(my)
-            app.tree_info['width'].append(width)
-            app.tree_info['state'].append('in')
-
-            if app.del_tree_btn['state'] == 'disabled':  # tree exist
-                app.del_tree_btn.config(state='normal')
-
-            length = len(app.tree_info['click_id'])
-
-            click_values = [length, width, 'in']
-            app.tree_table.insert('', 'end', iid=str(click_id), values=click_values)
+            # the tree_info and tree_table rows are added by app.on_db_change
+            click_id = db.add_click(img_id=tree_img_id, x=mx, y=my, return_value=True,
+                                    baf=self.baf, img_width=self.img_width)[0]
+            tree_row = app.tree_info.row(click_id)
+            self._index_point(self.click_ids['point'][-1], tree_row, 0, mx, my)
 
         else:   # edit exists point mode
-            tree_row = self.moving_cmode['tree_row']
             db.edit_click(click_id=tree_img_id, x=mx, y=my)
-            app.tree_info['x'][tree_row] = mx
-            app.tree_info['y'][tree_row] = my
-
-        app.local_refresh_img_table(self.baf)
+            self.point_grid.move(self.moving_cmode['move_p'], mx, my)
 
     def _update_shape_info(self, x, y):
         # when adding and dragging tree points, line and points follow mouse
@@ -1400,7 +1574,7 @@ class ScrolledCanvas(Frame):
         text_x = (x0 + x) / 2
         text_y = (y0 + y) / 2
         self.canvas.coords(line, [x0, y0, x, y])
-        self.canvas.coords(move_p, [x - 5, y - 5, x + 5, y + 5])
+        self.canvas.coords(move_p, [x, y])
         self.canvas.coords(text, [text_x, text_y])
 
         # change line colors
@@ -1419,17 +1593,15 @@ class ScrolledCanvas(Frame):
         self.canvas.coords(text_id, [x, y])
 
     def _get_shape_center(self, shape_id):
-        # return the tree edge points (oval) center coordinate as a fixed point
-        x1, y1, x2, y2 = self.canvas.coords(shape_id)
-        center_x = (x1 + x2) / 2
-        center_y = (y1 + y2) / 2
+        # return the tree edge points (image centered at) coordinate as a fixed point
+        center_x, center_y = self.canvas.coords(shape_id)
         return [center_x, center_y]
 
     def _pick_moving_ids(self, shape_id):
         # functions to update self.moving dictionary
         if app.mode.get() == 0:
-            if shape_id in self.shape_ids['point1']:
-                row_num = self.shape_ids['point1'].index(shape_id)
+            row_num, which = self.point_rows[shape_id]
+            if which == 1:
                 line_id = self.shape_ids['line'][row_num]
                 fixed_id = self.shape_ids['point2'][row_num]
                 text = self.shape_ids['text'][row_num]
@@ -1439,8 +1611,7 @@ class ScrolledCanvas(Frame):
                 self.moving['tree_row'] = row_num
                 self.moving['text'] = text
                 self.moving['which'] = 1
-            if shape_id in self.shape_ids['point2']:
-                row_num = self.shape_ids['point2'].index(shape_id)
+            else:
                 line_id = self.shape_ids['line'][row_num]
                 fixed_id = self.shape_ids['point1'][row_num]
                 text = self.shape_ids['text'][row_num]
@@ -1452,94 +1623,296 @@ class ScrolledCanvas(Frame):
                 self.moving['which'] = 2
         else:
             # moving_cmode = {'move_p':'point_id', 'text':'text_id', 'tree_row':0}
-            row_num = self.click_ids['point'].index(shape_id)
+            row_num, which = self.point_rows[shape_id]
             text_id = self.click_ids['text'][row_num]
             self.moving_cmode['move_p'] = shape_id
             self.moving_cmode['text'] = text_id
             self.moving_cmode['tree_row'] = row_num
 
 
-    def _zoom_shapes(self):
-        # functions changing points positions after zooming
+    def _zoom_shapes(self, scale):
+        # move all the tree shapes by one canvas transform about the origin (canvas coordinates are
+        # zoomed image coordinates), whatever the tree number is. Only the octagon radius is scaled with them,
+        # which is right as r_pixel grows with zoom_ratio, the point markers (images), texts and line widths
+        # keep their sizes
+        self.canvas.scale(self.tree_tag, 0, 0, scale, scale)
+
+    def _make_point_marker(self):
+        # yellow dot with black outline for the tree edge points
+        d = 2 * self.point_radius + 1
+        marker = Image.new('RGBA', (d, d), (0, 0, 0, 0))
+        ImageDraw.Draw(marker).ellipse([0, 0, d - 1, d - 1], fill='yellow', outline='black')
+        return PhotoImage(marker)
+
+    def _draw_trees(self):
+        # create the shapes of all the trees in app.tree_info, all the geometry is computed by numpy first,
+        # then only creating canvas items in the loop, progress bar (80 -> 100) only updated a few times
+        zoom = self.zoom_ratio
+        font = ('Times', '12', 'bold')
         if app.mode.get() == 0:
-            length = len(app.tree_info['tree_id'])
-            if length > 0:  # not empty tree
-                for i in range(length):
-                    lx, ly = app.tree_info['left'][i]
-                    rx, ry = app.tree_info['right'][i]
-                    lx *= self.zoom_ratio
-                    ly *= self.zoom_ratio
-                    rx *= self.zoom_ratio
-                    ry *= self.zoom_ratio
-                    center_x = (lx + rx) / 2
-                    center_y = (ly + ry) / 2
-                    p1_id = self.shape_ids['point1'][i]
-                    p2_id = self.shape_ids['point2'][i]
-                    l_id = self.shape_ids['line'][i]
-                    t_id = self.shape_ids['text'][i]
-                    self.canvas.coords(l_id, [lx, ly, rx, ry])
-                    self.canvas.coords(p1_id, [lx - 5, ly - 5, lx + 5, ly + 5])
-                    self.canvas.coords(p2_id, [rx - 5, ry - 5, rx + 5, ry + 5])
-                    self.canvas.coords(t_id, [center_x, center_y])
+            tree_num = len(app.tree_info)
+            left_img = column_stack([app.tree_info['lx'], app.tree_info['ly']])
+            right_img = column_stack([app.tree_info['rx'], app.tree_info['ry']])
+            left = left_img * zoom
+            right = right_img * zoom
+            in_tree = (app.tree_info['state'] & IN_TREE).tolist()
+            left_img = left_img.tolist()
+            right_img = right_img.tolist()
+            lines = hstack([left, right]).tolist()
+            points1 = left.tolist()
+            points2 = right.tolist()
+            texts = ((left + right) / 2).tolist()
+            for tree_row in range(tree_num):
+                fill = 'blue' if in_tree[tree_row] else 'red'
+                self.shape_ids['line'].append(
+                    self.canvas.create_line(*lines[tree_row], fill=fill, width=3, tags=self.tree_tag))
+                self.shape_ids['point1'].append(
+                    self.canvas.create_image(*points1[tree_row], image=self.point_marker, tags=self.tree_tag))
+                self.shape_ids['point2'].append(
+                    self.canvas.create_image(*points2[tree_row], image=self.point_marker, tags=self.tree_tag))
+                self.shape_ids['text'].append(
+                    self.canvas.create_text(*texts[tree_row], text=str(tree_row + 1), fill='yellow', font=font,
+                                            tags=self.tree_tag))
+                self._index_point(self.shape_ids['point1'][-1], tree_row, 1, *left_img[tree_row])
+                self._index_point(self.shape_ids['point2'][-1], tree_row, 2, *right_img[tree_row])
+                self._draw_progress(tree_row, tree_num)
         else:
-            length = len(app.tree_info['click_id'])
-            if length > 0:
-                for i in range(length):
-                    x = app.tree_info['x'][i] * self.zoom_ratio
-                    y = app.tree_info['y'][i] * self.zoom_ratio
-                    octagon_id = self.click_ids['point'][i]
-                    t_id = self.click_ids['text'][i]
+            tree_num = len(app.tree_info)
+            x_img = app.tree_info['x'].tolist()
+            y_img = app.tree_info['y'].tolist()
+            x = app.tree_info['x'] * zoom
+            y = app.tree_info['y'] * zoom
+            octagons = self.octagon_coords(x, y, self.r_pixel).tolist()
+            texts = zip(x.tolist(), y.tolist())
+            for tree_row, (text_x, text_y) in enumerate(texts):
+                self.click_ids['point'].append(
+                    self.canvas.create_polygon(*octagons[tree_row], fill='white', outline='black',
+                                               tags=self.tree_tag))
+                self.click_ids['text'].append(
+                    self.canvas.create_text(text_x, text_y, text=str(tree_row + 1), fill='black', font=font,
+                                            tags=self.tree_tag))
+                self._index_point(self.click_ids['point'][-1], tree_row, 0, x_img[tree_row], y_img[tree_row])
+                self._draw_progress(tree_row, tree_num)
 
-                    self.canvas_coords_octagon(octagon_id, x, y)
-                    self.canvas.coords(t_id, [x, y])
+    @staticmethod
+    def _draw_progress(tree_row, tree_num, steps=4):
+        if (tree_row + 1) % max(1, tree_num // steps) == 0:
+            app.update_progress(80 + 20 * (tree_row + 1) / tree_num)
 
     def _clear_canvas_all_trees(self):
-        # edge mode
-        for i in range(len(self.shape_ids['point1'])):
-            self.canvas.delete(self.shape_ids['point1'][i])
-            self.canvas.delete(self.shape_ids['point2'][i])
-            self.canvas.delete(self.shape_ids['line'][i])
-            self.canvas.delete(self.shape_ids['text'][i])
-        # click mode
-        for i in range(len(self.click_ids['point'])):
-            self.canvas.delete(self.click_ids['point'][i])
-            self.canvas.delete(self.click_ids['text'][i])
+        # both edge and click mode
+        self.canvas.delete(self.tree_tag)
+        self.point_grid.clear()
+        self.point_rows = {}
+
+    def _index_point(self, shape_id, tree_row, which, x, y):
+        # x, y in image coordinates
+        self.point_grid.add(shape_id, x, y)
+        self.point_rows[shape_id] = (tree_row, which)
+
+    def recolour_trees(self, tree_rows):
+        # edge mode, lines of tree rows coloured again by their (new) state in app.tree_info
+        self._update_r_pixel()
+        for tree_row in tree_rows:
+            fill = 'blue' if app.tree_info.get(tree_row, 'state') & IN_TREE else 'red'
+            self.canvas.itemconfigure(self.shape_ids['line'][tree_row], fill=fill)
 
+    def remove_trees(self, tree_rows):
+        # remove the shapes of tree rows (before app.tree_info refreshed), the later trees move up and renumbered
+        tree_rows = set(tree_rows)
+        if app.mode.get() == 0:
+            ids, kinds, points = self.shape_ids, ['point1', 'point2', 'line', 'text'], ['point1', 'point2']
+        else:
+            ids, kinds, points = self.click_ids, ['point', 'text'], ['point']
+        for kind in kinds:
+            for tree_row in tree_rows:
+                self.canvas.delete(ids[kind][tree_row])
+                if kind in points:
+                    self.point_grid.remove(ids[kind][tree_row])
+            ids[kind] = [shape_id for tree_row, shape_id in enumerate(ids[kind]) if tree_row not in tree_rows]
+
+        for tree_row in range(min(tree_rows, default=0), len(ids['text'])):
+            self.canvas.itemconfigure(ids['text'][tree_row], text=str(tree_row + 1))
+        self.point_rows = {}
+        for kind in points:
+            which = 0 if kind == 'point' else int(kind[-1])
+            for tree_row, shape_id in enumerate(ids[kind]):
+                self.point_rows[shape_id] = (tree_row, which)
 
-    def _update_img(self):
-        self.canvas.itemconfig(self.shape_ids['canvas_img'], image=self.save_photo)
-        width = self.save_photo.width()
-        height = self.save_photo.height()
-        self.canvas.config(scrollregion=(0, 0, width, height))
 
-    def _preprocess_img(self):
-        image = Image.open(self.img_dir)
-        image = equalize(image)
-        # draw center reference line
-        draw = ImageDraw.Draw(image)
-        draw.line([0, image.size[1] / 2, image.size[0], image.size[1] / 2], fill=(255, 255, 0))
+    def _update_img(self):
+        # show the zoomed image (or empty canvas) from scratch
+        self._clear_tiles()
+        self.canvas.config(scrollregion=(0, self.view_top, self.view_width, self.view_top + self.view_height))
+        self._schedule_tiles()
+
+    def _on_xscroll(self, first, last):
+        self.hbar.set(first, last)
+        self._schedule_tiles()
+
+    def _on_yscroll(self, first, last):
+        self.vbar.set(first, last)
+        self._schedule_tiles()
+
+    def _schedule_tiles(self, event=None):
+        # merge all the scroll events before tk idle into one tile refresh
+        if self.tile_refresh_job is None:
+            self.tile_refresh_job = self.after_idle(self._refresh_tiles)
+
+    def _refresh_tiles(self):
+        # create tiles of the visible region (+ margin) and delete the off-screen ones
+        self.tile_refresh_job = None
+        if self.save_image is None or self.zooming:  # the zoom preview is shown instead
+            return
 
-        self.save_image = image
-        del image, draw
+        size = self.tile_size
+        col_num = (self.view_width - 1) // size + 1
+        row_num = (self.view_height - 1) // size + 1
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0) - self.view_top  # tiles are in band coordinates
+        col_st = max(0, int(x0 // size) - self.tile_margin)
+        col_ed = min(col_num - 1, int((x0 + self.canvas.winfo_width()) // size) + self.tile_margin)
+        row_st = max(0, int(y0 // size) - self.tile_margin)
+        row_ed = min(row_num - 1, int((y0 + self.canvas.winfo_height()) // size) + self.tile_margin)
+        needed = {(c, r) for c in range(col_st, col_ed + 1) for r in range(row_st, row_ed + 1)}
+
+        for key in list(self.tiles.keys()):
+            if key not in needed:
+                self.canvas.delete(self.tiles.pop(key)[0])
+
+        for col, row in needed:
+            if (col, row) not in self.tiles:
+                box = (col * size, row * size,
+                       min((col + 1) * size, self.view_width), min((row + 1) * size, self.view_height))
+                photo = PhotoImage(self._get_tile_image(box))
+                item = self.canvas.create_image(box[0], self.view_top + box[1], image=photo, anchor='nw')
+                self.canvas.tag_lower(item)  # always under the tree shapes
+                self.tiles[(col, row)] = (item, photo)
+
+    def _get_tile_image(self, box):
+        # box is in zoomed band coordinates
+        if self.zoom_ratio <= 1.0:  # crop from the cached zoomed image
+            if self.zoom_ratio in self.zoom_cache:
+                return self.zoom_cache[self.zoom_ratio].crop(box)
+            # not resized yet, never resize the whole image in tk thread: a quick tile from the nearest
+            # pyramid level until the background one is shown
+            if self.zoom_loading is None or self.zoom_loading[0] != self.zoom_ratio or \
+                    self.zoom_loading[1] is not self.save_pyramid:
+                self._load_zoomed_img()
+            return render_tile(self.save_pyramid, self.zoom_ratio, box, resample=Image.NEAREST)
+        else:  # zoom in, only resample this tile, the whole zoomed image is never built
+            return render_tile(self.save_pyramid, self.zoom_ratio, box)
+
+    def _clear_tiles(self):
+        for item, photo in self.tiles.values():
+            self.canvas.delete(item)
+        self.tiles = {}
+        if self.preview is not None:
+            self.canvas.delete(self.preview[0])
+            self.preview = None
+
+    def _submit_load(self, kind, work, on_done):
+        # work() runs in a loader thread, then on_done(result) in tk thread,
+        # the former job of the same kind is stale now: cancelled if not started yet, or its result dropped
+        token = self.load_tokens.get(kind, 0) + 1
+        self.load_tokens[kind] = token
+        if kind in self.load_futures:
+            self.load_futures[kind].cancel()
+
+        def _work():
+            try:
+                result = work()
+            except Exception as e:  # raised again in tk thread
+                result = e
+            self.load_queue.put((kind, token, on_done, result))
+
+        self.load_futures[kind] = self.loader.submit(_work)
+        if not self.load_polling:
+            self.load_polling = True
+            self.after(self.load_poll_interval, self._poll_load_queue)
+
+    def _drop_loads(self):
+        # results of all the submitted jobs are stale
+        for kind in self.load_tokens:
+            self.load_tokens[kind] += 1
+
+    def _poll_load_queue(self):
+        try:
+            while True:
+                kind, token, on_done, result = self.load_queue.get_nowait()
+                if token == self.load_tokens[kind]:
+                    if isinstance(result, Exception):
+                        raise result
+                    on_done(result)
+        except Empty:
+            pass
+        finally:
+            if all(future.done() for future in self.load_futures.values()) and self.load_queue.empty():
+                self.load_polling = False
+            else:
+                self.after(self.load_poll_interval, self._poll_load_queue)
+
+    def _load_img(self, on_loaded):
+        # preprocess the current image in background, then on_loaded(item)
+        img_dir = self.img_dir
+        options = self.load_options(self.zoom_ratio)
+        zoom_ratio = self.zoom_ratio
+        self.image_cache.pin(img_dir, options)  # the prefetched neighbours never evict it
+
+        def _load():
+            # from the prefetched images if possible
+            item = self.prefetcher.load(img_dir, options)
+            if zoom_ratio <= 1.0:  # also the zoomed image, tiles are only cropped from it in tk thread
+                item = dict(item, zoomed=resize_from_pyramid(item['pyramid'], zoom_ratio, item['full_size']),
+                            zoom_ratio=zoom_ratio)
+            return item
+
+        self._submit_load('image', _load, on_loaded)
+
+    def _show_loaded_img(self, item):
+        self._set_loaded_img(item)
+        if not self.zooming:  # otherwise shown by the coming refresh_zoomed_image()
+            self._resize_img()
+            self._update_img()
+        app.update_progress(100)
+
+    def _load_zoomed_img(self):
+        # resize the loaded image to the current zoom ratio in background, then show it
+        pyramid = self.save_pyramid
+        zoom_ratio = self.zoom_ratio
+        full_size = (self.img_width, self.band_height)
+        self.zoom_loading = (zoom_ratio, pyramid)
+
+        def _show(zoomed):
+            if pyramid is not self.save_pyramid:  # resized from the image loaded before
+                return
+            self.zoom_cache[zoom_ratio] = zoomed
+            if zoom_ratio == self.zoom_ratio and not self.zooming:
+                self._update_img()
+
+        self._submit_load('zoom', lambda: resize_from_pyramid(pyramid, zoom_ratio, full_size), _show)
+
+    def _set_loaded_img(self, item):
+        self.save_image = item['image']
+        self.load_scale = item['pyramid'][0][0]
+        # each zoom step then resamples from the nearest pyramid level
+        self.save_pyramid = item['pyramid']
+        self.band_top = item['top']
+        self.band_height = item['full_size'][1]
+        self.load_timings = item['timings']
+        self.zoom_cache = {}
+        if 'zoomed' in item:
+            self.zoom_cache[item['zoom_ratio']] = item['zoomed']
+        if self.img_lut is None and item['lut'] is not None:  # the next opening skips the histogram
+            self.img_lut = item['lut']
+            db.edit_img_lut(self.img_id, self.img_lut)
+            app.make_unsaved()  # kept in the project file by the next save, like the other edits
 
     def _resize_img(self):
-        if self.zoom_ratio == 1.0:
-            self.save_photo = PhotoImage(self.save_image)
-        else:
-            width, height = self.save_image.size
-            if self.zoom_ratio < 1.0:
-                img_zoom = self.save_image.resize((int(width * self.zoom_ratio),
-                                                   int(height * self.zoom_ratio)), Image.ANTIALIAS)
-            else:
-                img_zoom = self.save_image.resize((int(width * self.zoom_ratio),
-                                                   int(height * self.zoom_ratio)), Image.BICUBIC)
-            try:
-                self.save_photo = PhotoImage(img_zoom)
-                del img_zoom
-            except (MemoryError, TclError):
-                showwarning('Warning', 'Not enough memory to support zoom in this size, please try another one')
-                self.zoom_ratio = 1.0
-                self.save_photo = PhotoImage(self.save_image)
+        # tiles are rendered lazily by _refresh_tiles, only the zoomed size is needed here
+        self.view_width = int(self.img_width * self.zoom_ratio)
+        self.view_height = int(self.band_height * self.zoom_ratio)
+        self.view_top = int(self.band_top * self.zoom_ratio)
 
 
 class TkErrorCatcher:
@@ -1570,6 +1943,7 @@ if __name__ == '__main__':
     tkinter.CallWrapper = TkErrorCatcher
     app = Pano2BA()
     db = DataBase('~$default.sqlite')
+    db.subscribe(app.on_db_change)
     try:
         app.mainloop()
     except Exception as e:
@@ -0,0 +1,510 @@
+import os
+import sys
+import glob
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+from time import perf_counter
+from numpy import asarray, savez, load, frombuffer, uint8, arange, cumsum, argmax, minimum, maximum, around, clip, \
+    tile, empty, int64
+from PIL import Image, ImageDraw
+
+default_options = {'enhance': 'equalize'}  # preprocess_image() keyword options
+enhance_methods = ['equalize', 'gamma', 'stretch', 'none']
+enhance_gamma = 2.0  # > 1 brightens the dark understory
+histogram_step = 4  # histograms only count every 4th row and column (1/16 pixels), nearly the same result
+
+
+def preprocess_image(img_dir, enhance='equalize', scale=1.0, band=1.0, lut=None):
+    # load image, enhancement (enhance_methods), and draw the center reference line
+    # scale < 1 (1/2, 1/4, 1/8) only decodes a reduced image, JPEG by the DCT scaling of draft mode
+    # band < 1 only keeps the vertical band (ratio of image height) around the horizon (image center),
+    #     cropped before the enhancement, so the histogram is also only of the trees at breast height
+    # lut is the enhance_lut() of this image computed before (saved in the project), skips the histogram
+    # return {'image': PIL.Image(), 'pyramid': [(ratio, PIL.Image()), ...],
+    #         'full_size': (w, h) of the band at full resolution, 'top': band top row in the full image,
+    #         'lut': enhance_lut() used, 'timings': {step: seconds}}
+    # no tkinter here, safe to run in worker threads
+    timings = {}
+    st = perf_counter()
+    image = Image.open(img_dir)
+    full_size = image.size
+    if scale < 1.0:
+        reduced_size = (int(ceil(full_size[0] * scale)), int(ceil(full_size[1] * scale)))
+        image.draft(image.mode, reduced_size)  # only works for JPEG
+        if image.size != reduced_size:  # other formats, reduce after decoding
+            image = image.reduce(int(round(1 / scale)))
+    top = 0
+    if band < 1.0:
+        top, bottom = band_rows(full_size[1], band)
+        decoded_scale = image.size[1] / full_size[1]
+        image = image.crop((0, int(round(top * decoded_scale)),
+                            image.size[0], int(round(bottom * decoded_scale))))
+        full_size = (full_size[0], bottom - top)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.load()  # lazy decoding is done here, at the latest
+    timings['decode'] = perf_counter() - st
+
+    st = perf_counter()
+    if lut is None:
+        lut = enhance_lut(image, enhance)
+    timings['lut'] = perf_counter() - st
+
+    st = perf_counter()
+    if lut is not None:
+        image = image.point(list(lut))  # one pass for all the channels
+    timings['apply'] = perf_counter() - st
+
+    # draw center reference line
+    draw = ImageDraw.Draw(image)
+    draw.line([0, image.size[1] / 2, image.size[0], image.size[1] / 2], fill=(255, 255, 0))
+    del draw
+
+    return {'image': image, 'pyramid': build_pyramid(image, ratio=scale), 'full_size': full_size, 'top': top,
+            'lut': lut, 'timings': timings}
+
+
+def subsampled_histogram(image, step=histogram_step):
+    # (3, 256) histogram of the RGB image, only every step-th row and column
+    # picked by a nearest resize, never copies the whole image into numpy
+    grid = image.resize((max(1, image.size[0] // step), max(1, image.size[1] // step)), Image.NEAREST)
+    return asarray(grid.histogram()).reshape(3, 256)
+
+
+def equalize_lut(hist):
+    # (3, 256) lookup table of each channel histogram, the same as PIL.ImageOps.equalize()
+    lut = empty((3, 256), dtype=int64)
+    for c, h in enumerate(hist):
+        nonzero = h[h > 0]
+        step = (nonzero.sum() - nonzero[-1]) // 255 if len(nonzero) > 1 else 0
+        if step == 0:
+            lut[c] = arange(256)
+        else:
+            lut[c] = (step // 2 + cumsum(h) - h) // step
+    return minimum(lut, 255)
+
+
+def gamma_lut(gamma=enhance_gamma):
+    # (3, 256) lookup table of gamma correction, no histogram needed
+    return tile(around(255 * (arange(256) / 255) ** (1 / gamma)), (3, 1))
+
+
+def stretch_lut(hist, cut=0.005):
+    # (3, 256) lookup table linearly stretching [cut, 1 - cut] percentiles of each channel to [0, 255]
+    cdf = cumsum(hist, axis=1) / hist.sum(axis=1, keepdims=True)
+    low = argmax(cdf > cut, axis=1)
+    high = maximum(argmax(cdf >= 1 - cut, axis=1), low + 1)
+    return clip(around((arange(256) - low[:, None]) * 255 / (high - low)[:, None]), 0, 255)
+
+
+def enhance_lut(image, enhance):
+    # lookup table of enhance method for the RGB image, as 768 bytes (R, G, B), None for no enhancement
+    if enhance == 'equalize':
+        lut = equalize_lut(subsampled_histogram(image))
+    elif enhance == 'gamma':
+        lut = gamma_lut()
+    elif enhance == 'stretch':
+        lut = stretch_lut(subsampled_histogram(image))
+    else:
+        return None
+    return lut.astype(uint8).tobytes()
+
+
+def band_rows(img_height, band):
+    # (top, bottom) rows of the vertical band around the image center (horizon)
+    top = int(round(img_height * (1 - band) / 2))
+    return top, img_height - top
+
+
+def draft_scale(zoom_ratio):
+    # the smallest JPEG DCT scale (1, 1/2, 1/4, 1/8) still not smaller than zoom_ratio
+    scale = 1.0
+    while scale / 2 >= zoom_ratio and scale > 1 / 8:
+        scale /= 2
+    return scale
+
+
+def options_key(options):
+    # hashable form of preprocess_image() keyword options
+    # lut is only a shortcut computed from the image and the other options, not a part of the key
+    return tuple(sorted((k, v) for k, v in options.items() if k != 'lut'))
+
+
+def image_nbytes(image):
+    return image.size[0] * image.size[1] * len(image.getbands())
+
+
+def build_pyramid(image, ratio=1.0, min_size=512):
+    # downsample the image by half each level once, until the short side < min_size * 2
+    # ratio is the image size to the full image size
+    # return [(ratio, level_image), ...] from ratio to the smallest level
+    levels = [(ratio, image)]
+    while min(image.size) >= min_size * 2:
+        image = image.reduce(2)  # 2x2 box average, much cheaper than a LANCZOS resize
+        levels.append((levels[-1][0] / 2, image))
+
+    return levels
+
+
+def _nearest_level(levels, ratio):
+    # the smallest level not smaller than ratio, the largest level for zooming in
+    level_ratio, level = levels[0]
+    for lr, li in levels:
+        if lr >= ratio:
+            level_ratio, level = lr, li
+    return level_ratio, level
+
+
+def resize_from_pyramid(levels, ratio, full_size):
+    # resize to ratio (of the full image size) from the nearest level not smaller than it
+    full_width, full_height = full_size
+    size = (int(full_width * ratio), int(full_height * ratio))
+
+    level_ratio, level = _nearest_level(levels, ratio)
+
+    if level.size == size:
+        return level
+    elif level_ratio > ratio:  # zoom out
+        return level.resize(size, Image.LANCZOS)
+    else:  # zoom in
+        return level.resize(size, Image.BICUBIC)
+
+
+def render_tile(levels, ratio, box, resample=None):
+    # render only the box (left, upper, right, lower) of the image zoomed to ratio,
+    # memory keeps the tile size whatever the zoom ratio is
+    # resample is LANCZOS for zoom out and BICUBIC for zoom in by default, NEAREST for quick previews
+    level_ratio, level = _nearest_level(levels, ratio)
+    scale = level_ratio / ratio
+    size = (box[2] - box[0], box[3] - box[1])
+    level_box = (box[0] * scale, box[1] * scale,
+                 min(box[2] * scale, level.size[0]), min(box[3] * scale, level.size[1]))
+
+    if scale == 1:
+        return level.crop(box)
+    elif resample is not None:
+        return level.resize(size, resample, box=level_box)
+    elif scale > 1:  # zoom out
+        return level.resize(size, Image.LANCZOS, box=level_box)
+    else:  # zoom in
+        return level.resize(size, Image.BICUBIC, box=level_box)
+
+
+class ImageCache:
+    # LRU cache of preprocess_image() results kept under a memory budget (bytes)
+    # key is (img_dir, file mtime, preprocess options), so changed source files are never hit
+    # pyramid levels are also kept if keep_pyramid, or rebuilt (cheap) when got again
+    def __init__(self, budget=1024 ** 3, keep_pyramid=True):
+        self.budget = budget
+        self.keep_pyramid = keep_pyramid
+        self.nbytes = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pinned = None  # key of the opened image, never evicted by the prefetched ones
+
+    @staticmethod
+    def key(img_dir, options):
+        try:
+            mtime = os.path.getmtime(img_dir)
+        except OSError:
+            mtime = None
+        return img_dir, mtime, options_key(options)
+
+    @staticmethod
+    def sizeof(item):
+        if 'pyramid' in item:
+            return sum(image_nbytes(level) for ratio, level in item['pyramid'])
+        else:
+            return image_nbytes(item['image'])
+
+    def get(self, img_dir, options):
+        key = self.key(img_dir, options)
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                self.items.move_to_end(key)
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if item is not None and 'pyramid' not in item:
+            item = dict(item, pyramid=build_pyramid(item['image'], ratio=item['ratio']))
+        return item
+
+    def put(self, img_dir, options, item):
+        key = self.key(img_dir, options)
+        if not self.keep_pyramid:
+            item = dict(item, ratio=item['pyramid'][0][0])
+            del item['pyramid']
+        size = self.sizeof(item)
+        with self.lock:
+            if key in self.items:
+                self.nbytes -= self.sizeof(self.items.pop(key))
+            self.items[key] = item
+            self.nbytes += size
+            # least recently used first, always keep the newest and the pinned one
+            while self.nbytes > self.budget:
+                old_key = next((k for k in self.items if k != key and k != self.pinned), None)
+                if old_key is None:
+                    break
+                self.nbytes -= self.sizeof(self.items.pop(old_key))
+                self.evictions += 1
+
+    def pin(self, img_dir, options):
+        # the opened image, kept however many images are prefetched after it
+        key = self.key(img_dir, options)
+        with self.lock:
+            self.pinned = key
+
+    def pinned_nbytes(self):
+        with self.lock:
+            item = self.items.get(self.pinned)
+            return 0 if item is None else self.sizeof(item)
+
+    def sizeof_cached(self, img_dir, options):
+        # bytes of a cached image without counting it as a lookup, None if not cached
+        key = self.key(img_dir, options)
+        with self.lock:
+            item = self.items.get(key)
+            return None if item is None else self.sizeof(item)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'images': len(self.items), 'nbytes': self.nbytes, 'budget': self.budget,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups > 0 else 0.0}
+
+    def clear(self):
+        with self.lock:
+            self.items = OrderedDict()
+            self.nbytes = 0
+
+
+class DiskCache:
+    # preprocess_image() results saved as uncompressed numpy arrays (.npz), much faster to read
+    # than decoding and equalizing the original jpg, file names are
+    #     <hash of img_dir>_<hash of file size and mtime>_<hash of preprocess options>.npz
+    # so a changed source file is never hit, and its outdated caches (any options) are removed when a new one
+    # is saved, the caches of the same source under other options (scale, band, enhance) are kept
+    # a full resolution image takes ~56 MB, the folder is kept under budget (bytes) by removing the least
+    # recently read files, and remove(img_dir) drops the files of an image removed from the project
+    def __init__(self, cache_dir, budget=10 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.budget = budget
+
+    @staticmethod
+    def cache_dir_of(db_path):
+        # project.sqlite -> project_cache/ next to it
+        return os.path.splitext(db_path)[0] + '_cache'
+
+    def path(self, img_dir, options):
+        options_hash = self._hash('{}'.format(options_key(options)))
+        return os.path.join(self.cache_dir, self._source_prefix(img_dir) + '_' + options_hash + '.npz')
+
+    def _source_prefix(self, img_dir):
+        # <hash of img_dir>_<hash of file size and mtime>
+        stat = os.stat(img_dir)
+        return self._path_hash(img_dir) + '_' + self._hash('{}|{}'.format(stat.st_size, stat.st_mtime_ns))
+
+    def _path_hash(self, img_dir):
+        return self._hash(os.path.abspath(img_dir))
+
+    @staticmethod
+    def _hash(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def get(self, img_dir, options):
+        st = perf_counter()
+        try:
+            path = self.path(img_dir, options)
+            with load(path) as data:
+                levels = [Image.fromarray(data['level{}'.format(i)]) for i in range(len(data['ratios']))]
+                ratios = data['ratios'].tolist()
+                full_size = tuple(data['full_size'].tolist())
+                top = int(data['top'])
+                lut = data['lut'].tobytes() or None
+            os.utime(path)  # recently read, the last to be pruned
+        except (OSError, KeyError, ValueError):  # not cached, source removed, or broken file
+            return None
+        return {'image': levels[0], 'pyramid': list(zip(ratios, levels)), 'full_size': full_size, 'top': top,
+                'lut': lut, 'timings': {'disk cache': perf_counter() - st}}
+
+    def put(self, img_dir, options, item):
+        path = self.path(img_dir, options)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        arrays = {'level{}'.format(i): asarray(level) for i, (ratio, level) in enumerate(item['pyramid'])}
+        arrays['ratios'] = asarray([ratio for ratio, level in item['pyramid']])
+        arrays['full_size'] = asarray(item['full_size'])
+        arrays['top'] = asarray(item['top'])
+        arrays['lut'] = frombuffer(item['lut'] or b'', dtype=uint8)
+        # never leave a half written cache file, the temp file is unique as the same image
+        # can be saved by several threads at once (prefetching, or listed twice in a project)
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                savez(f, **arrays)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        # remove the caches of the same image made from an older version of the source file
+        source_prefix = self._source_prefix(img_dir)
+        for old_path in glob.glob(os.path.join(self.cache_dir, self._path_hash(img_dir) + '_*.npz')):
+            if not os.path.basename(old_path).startswith(source_prefix + '_'):
+                self._remove(old_path)
+        self.prune(keep=path)
+
+    def remove(self, img_dir):
+        # all the caches of an image (any version and options)
+        for path in glob.glob(os.path.join(self.cache_dir, self._path_hash(img_dir) + '_*.npz')):
+            self._remove(path)
+
+    def prune(self, keep=None):
+        # remove the least recently read (or saved) files until the folder fits in budget
+        try:
+            with os.scandir(self.cache_dir) as it:
+                files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                         for entry in it if entry.name.endswith('.npz')]
+        except FileNotFoundError:
+            return
+        nbytes = sum(size for mtime, size, path in files)
+        for mtime, size, path in sorted(files):
+            if nbytes <= self.budget:
+                break
+            if path != keep:
+                self._remove(path)
+                nbytes -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # already removed by another thread
+            pass
+
+
+class Prefetcher:
+    # preprocess images in worker threads and put them into the ImageCache
+    def __init__(self, cache, workers=2, disk_cache=None, write_disk_cache=False):
+        self.cache = cache
+        self.disk_cache = disk_cache  # DiskCache of the opened project, or None
+        # the disk cache is always read (e.g. warmed by warm_disk_cache), but only saved to if asked
+        self.write_disk_cache = write_disk_cache
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}  # {(img_dir, options): Future}
+        self.estimates = {}  # {(img_dir, options): estimated bytes in cache}, see estimate_size()
+        self.lock = threading.Lock()  # load() is also called from the image loading thread of gui
+
+    def prefetch(self, img_dirs, options):
+        # queue img_dirs (nearest first), cancel the queued ones not wanted any more
+        # options is one for all, or a list of the options of each image
+        if isinstance(options, dict):
+            options = [options] * len(img_dirs)
+        wanted = {(img_dir, options_key(opt)) for img_dir, opt in zip(img_dirs, options)}
+        with self.lock:
+            for job in list(self.futures.keys()):
+                future = self.futures[job]
+                if future.done() or (job not in wanted and future.cancel()):
+                    del self.futures[job]
+
+            # only prefetch what the budget can hold together with the opened image,
+            # the queued and running jobs are counted by their estimated size
+            budget = self.cache.budget - self.cache.pinned_nbytes()
+            for img_dir, opt in zip(img_dirs, options):
+                job = (img_dir, options_key(opt))
+                cached = self.cache.sizeof_cached(img_dir, opt)
+                size = self.estimate_size(img_dir, opt) if cached is None else cached
+                if size > budget:
+                    break
+                budget -= size
+                if cached is None and job not in self.futures:
+                    self.futures[job] = self.pool.submit(self._load, img_dir, opt)
+
+    def estimate_size(self, img_dir, options):
+        # bytes of an image in cache before preprocessing it, by the size in the file header
+        # (PIL only reads the header here), the scaled and cropped image of 3 bands, + 1/3 for the pyramid
+        job = (img_dir, options_key(options))
+        if job not in self.estimates:
+            try:
+                with Image.open(img_dir) as image:
+                    width, height = image.size
+            except OSError:
+                width, height = 0, 0
+            scale = options.get('scale', 1.0)
+            size = width * height * scale ** 2 * options.get('band', 1.0) * 3
+            self.estimates[job] = int(size * 4 / 3 if self.cache.keep_pyramid else size)
+        return self.estimates[job]
+
+    def load(self, img_dir, options):
+        # preprocessed image from cache, a running prefetch, or load now in the calling thread
+        item = self.cache.get(img_dir, options)
+        if item is None:
+            with self.lock:
+                future = self.futures.pop((img_dir, options_key(options)), None)
+            if future is not None and not future.cancel():
+                item = future.result()  # prefetch already started, just wait it
+            else:
+                item = self._load(img_dir, options)
+        return item
+
+    def _load(self, img_dir, options):
+        disk_cache = self.disk_cache
+        item = None
+        if disk_cache is not None:
+            item = disk_cache.get(img_dir, options)
+        if item is None:
+            item = preprocess_image(img_dir, **options)
+            if disk_cache is not None and self.write_disk_cache:  # saving is slow, do not let the caller wait
+                self.pool.submit(disk_cache.put, img_dir, options, item)
+        self.cache.put(img_dir, options, item)
+        return item
+
+
+def warm_disk_cache(db_path, options, scales=(1.0, 0.5), workers=4, budget=10 * 1024 ** 3):
+    # preprocess all the images of a project into its DiskCache, e.g. overnight
+    # scales are the decoding scales to prepare, full resolution and the default overview
+    # budget (bytes) of the cache folder, ~68 MB per image for the default scales
+    from db import DataBase
+
+    disk_cache = DiskCache(DiskCache.cache_dir_of(db_path), budget)
+    db = DataBase(db_path)
+    db.update_db()  # projects not opened by this version yet lack the band / enhance columns and the indexes
+    img_info = db.get_img_info()
+    db.conn.close()
+    img_dirs = img_info['img_dir'].tolist()
+    img_options = {img_dir: dict(options, band=band, enhance=enhance)
+                   for img_dir, band, enhance in zip(img_dirs, img_info['band'].tolist(), img_info['enhance'].tolist())}
+
+    def _warm(img_dir):
+        for scale in scales:
+            scale_options = dict(img_options[img_dir], scale=scale)
+            if not os.path.exists(disk_cache.path(img_dir, scale_options)):
+                disk_cache.put(img_dir, scale_options, preprocess_image(img_dir, **scale_options))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_warm, img_dir) for img_dir in img_dirs]
+        for i, (img_dir, future) in enumerate(zip(img_dirs, futures)):
+            try:
+                future.result()
+                print('[{}/{}] {}'.format(i + 1, len(img_dirs), img_dir))
+            except Exception as e:
+                print('[{}/{}] {} failed: {}'.format(i + 1, len(img_dirs), img_dir, e))
+
+
+if __name__ == '__main__':
+    # python imgproc.py project.sqlite [workers] [budget GB]
+    if len(sys.argv) < 2 or not os.path.exists(sys.argv[1]):
+        print('usage: python imgproc.py project.sqlite [workers] [budget GB]\n'
+              'pre-warm the preview cache of all the images in a Panorama2BA project (10 GB at most by default)')
+    else:
+        warm_disk_cache(sys.argv[1], default_options,
+                        workers=int(sys.argv[2]) if len(sys.argv) > 2 else 4,
+                        budget=int(float(sys.argv[3]) * 1024 ** 3) if len(sys.argv) > 3 else 10 * 1024 ** 3)
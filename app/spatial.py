@@ -0,0 +1,43 @@
+class PointGrid:
+    # grid spatial index of points (tree edge points, click points) in image coordinates,
+    # finding the point under cursor only checks the cells around it, whatever the point number is
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = {}  # {(col, row): {key: (x, y)}}
+        self.points = {}  # {key: (x, y)}
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add(self, key, x, y):
+        self.points[key] = (x, y)
+        self.cells.setdefault(self._cell(x, y), {})[key] = (x, y)
+
+    def remove(self, key):
+        x, y = self.points.pop(key)
+        cell = self._cell(x, y)
+        del self.cells[cell][key]
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def move(self, key, x, y):
+        self.remove(key)
+        self.add(key, x, y)
+
+    def clear(self):
+        self.cells = {}
+        self.points = {}
+
+    def nearest(self, x, y, radius):
+        # key of the nearest point within radius to (x, y), None if no point there
+        col_st, row_st = self._cell(x - radius, y - radius)
+        col_ed, row_ed = self._cell(x + radius, y + radius)
+        nearest_key = None
+        nearest_d2 = radius ** 2
+        for col in range(col_st, col_ed + 1):
+            for row in range(row_st, row_ed + 1):
+                for key, (px, py) in self.cells.get((col, row), {}).items():
+                    d2 = (px - x) ** 2 + (py - y) ** 2
+                    if d2 <= nearest_d2:
+                        nearest_key, nearest_d2 = key, d2
+        return nearest_key
@@ -0,0 +1,147 @@
+from numpy import empty, ones, int64, float64, uint8, asarray, count_nonzero, flatnonzero
+
+IN_TREE = 1  # bit of TreeStore 'state' column
+
+img_columns = [('img_id', int64), ('img_dir', object), ('img_name', object), ('width', int64), ('height', int64),
+               ('baf', float64), ('mode', int64), ('band', float64), ('enhance', object),
+               ('in_num', int64), ('ba', float64)]
+tree_columns = [('tree_id', int64), ('lx', float64), ('ly', float64), ('rx', float64), ('ry', float64),
+                ('width', int64), ('max_baf', float64), ('state', uint8)]
+click_columns = [('click_id', int64), ('x', float64), ('y', float64), ('width', int64), ('state', uint8)]
+tree_all_columns = [('img_id', int64), ('tree_id', int64), ('width', int64), ('max_baf', float64)]
+click_all_columns = [('img_id', int64), ('click_id', int64), ('x', float64), ('y', float64), ('baf', float64)]
+
+
+class ColumnStore:
+    # in memory table of numpy columns (one array for each column), replacing the dict of python lists
+    #     store['max_baf']          column array (view) of all the rows, for vectorized reading
+    #     store.get(row, 'img_dir')  one python value
+    #     store.row(img_id)         row of an id by the hash index, O(1)
+    # rows are appended to spare capacity (doubled when full), removing rows compacts the arrays
+    def __init__(self, columns, id_column, capacity=16):
+        # columns = [(name, numpy dtype), ...], use object for str
+        self.dtypes = dict(columns)
+        self.names = [name for name, dtype in columns]
+        self.id_column = id_column
+        self.size = 0
+        self.data = {name: empty(capacity, dtype) for name, dtype in columns}
+        self.row_of = {}  # {id: row}
+
+    @classmethod
+    def from_columns(cls, columns, id_column, values):
+        # store of the column values = {name: sequence}, the rows in the given order
+        store = cls(columns, id_column, capacity=max(16, len(values[id_column])))
+        store._fill(values)
+        return store
+
+    def _fill(self, values):
+        size = len(values[self.id_column])
+        if size > 0:
+            for name in self.names:
+                self.data[name][:size] = asarray(values[name], dtype=self.dtypes[name])
+        self.size = size
+        self._index()
+
+    def _index(self):
+        self.row_of = {i: row for row, i in enumerate(self.data[self.id_column][:self.size].tolist())}
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    def __contains__(self, i):
+        return i in self.row_of
+
+    def row(self, i):
+        return self.row_of[i]
+
+    def get(self, row, name):
+        return self.data[name].item(row)
+
+    def ids(self):
+        return self.data[self.id_column][:self.size].tolist()
+
+    def values(self, row):
+        # {column name: python value} of one row, e.g. store.append(**other.values(row))
+        return {name: self.data[name].item(row) for name in self.names}
+
+    def append(self, **values):
+        # add one row (all the columns given), return its row number
+        if self.size == len(self.data[self.id_column]):
+            for name in self.names:
+                column = empty(2 * self.size, self.dtypes[name])
+                column[:self.size] = self.data[name][:self.size]
+                self.data[name] = column
+        row = self.size
+        for name in self.names:
+            self.data[name][row] = values[name]
+        self.size += 1
+        self.row_of[values[self.id_column]] = row
+        return row
+
+    def update(self, row, **values):
+        for name, value in values.items():
+            self.data[name][row] = value
+
+    def remove(self, ids):
+        # remove the rows of ids, the later rows move up, return the removed rows (before removing)
+        rows = sorted(self.row_of[i] for i in ids)
+        keep = ones(self.size, dtype=bool)
+        keep[rows] = False
+        size = int(count_nonzero(keep))
+        for name in self.names:
+            self.data[name][:size] = self.data[name][:self.size][keep]
+        self.size = size
+        self._index()
+        return rows
+
+    def to_dict(self):
+        return {name: self[name].tolist() for name in self.names}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class TreeStore(ColumnStore):
+    # trees (edge mode) or clicks (click mode) of one image, with the in tree number counted on every change
+    def __init__(self, mode=0, capacity=16):
+        if mode == 0:
+            ColumnStore.__init__(self, tree_columns, 'tree_id', capacity)
+        else:
+            ColumnStore.__init__(self, click_columns, 'click_id', capacity)
+        self.mode = mode
+        self.in_num = 0
+
+    @classmethod
+    def from_columns(cls, mode, values):
+        store = cls(mode, capacity=max(16, len(values['state'])))
+        store._fill(values)
+        store.in_num = int(count_nonzero(store['state'] & IN_TREE))
+        return store
+
+    def append(self, **values):
+        self.in_num += int(values['state']) & IN_TREE
+        return ColumnStore.append(self, **values)
+
+    def update(self, row, **values):
+        if 'state' in values:
+            self.in_num += (int(values['state']) & IN_TREE) - (int(self.data['state'][row]) & IN_TREE)
+        ColumnStore.update(self, row, **values)
+
+    def remove(self, ids):
+        self.in_num -= sum(int(self.data['state'][self.row_of[i]]) & IN_TREE for i in ids)
+        return ColumnStore.remove(self, ids)
+
+    def state_name(self, row):
+        return 'in' if self.data['state'][row] & IN_TREE else 'out'
+
+    def change_baf(self, baf):
+        # edge mode, in/out state of all the trees under the new baf by their max_baf,
+        # return the rows whose state flipped, only these need to be shown again
+        state = (self['max_baf'] >= baf).astype(uint8) * IN_TREE
+        flipped = flatnonzero(state != self['state'])
+        self.data['state'][:self.size] = state
+        self.in_num = int(count_nonzero(state))
+        return flipped.tolist()
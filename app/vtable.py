@@ -0,0 +1,184 @@
+from tkinter import Frame, Scrollbar
+from tkinter.ttk import Treeview, Style
+
+
+class VirtualTable(Frame):
+    # Treeview only holding the visible rows of a long id list, the other rows are not Tk items,
+    # scrolling, refreshing and selecting cost the number of visible rows, not the total row number
+    #     values_of(ids)                 -> [values of each id], read from the columnar data source
+    #     sorter(column, descending)     -> all the ids in new order (sorted by sqlite), None to disable sorting
+    # the selection is kept by id (str iid as Treeview) and survives scrolling, sorting and refreshing
+    def __init__(self, parent, columns, values_of, sorter=None):
+        # columns = [(name, width), ...]
+        Frame.__init__(self, parent)
+        self.values_of = values_of
+        self.sorter = sorter
+        self.sort_column = None
+        self.descending = False
+
+        self.ids = []  # all the ids in display order
+        self.position = {}  # {id: index in ids}
+        self.selected = set()
+        self.anchor = None  # id of the last clicked row, start of shift selection
+        self.first = 0  # index of the first visible row
+        self.rows = 1  # visible row number, by widget height
+        self.row_height = int(Style(self).lookup('Treeview', 'rowheight') or 20)
+
+        self.tree = Treeview(self, show='headings', columns=[name for name, width in columns])
+        self.bar = Scrollbar(self, command=self.yview, bg='white')
+        for name, width in columns:
+            self.tree.column(name, width=width, anchor='center')
+            self.tree.heading(name, text=name, command=lambda name=name: self.sort(name))
+        self.bar.pack(side='right', fill='y')
+        self.tree.pack(side='top', fill='both', expand='yes')
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<Button-1>', self._on_click)
+        self.tree.bind('<Control-Button-1>', lambda event: self._on_click(event, toggle=True))
+        self.tree.bind('<Shift-Button-1>', lambda event: self._on_click(event, extend=True))
+        self.tree.bind('<Up>', lambda event: self._on_key(-1))
+        self.tree.bind('<Down>', lambda event: self._on_key(1))
+        self.tree.bind('<Shift-Up>', lambda event: self._on_key(-1, extend=True))
+        self.tree.bind('<Shift-Down>', lambda event: self._on_key(1, extend=True))
+        self.tree.bind('<MouseWheel>', lambda event: self._on_wheel(-1 if event.delta > 0 else 1))
+        self.tree.bind('<Button-4>', lambda event: self._on_wheel(-1))
+        self.tree.bind('<Button-5>', lambda event: self._on_wheel(1))
+
+    def bind(self, sequence=None, func=None, add=None):
+        # mouse and key events of the rows
+        return self.tree.bind(sequence, func, add)
+
+    # ============
+    #  data
+    # ============
+    def set_ids(self, ids):
+        # show a new id list, the selected ids still in the list are kept
+        self.ids = list(ids)
+        self.position = {i: index for index, i in enumerate(self.ids)}
+        self.selected = {i for i in self.selected if i in self.position}
+        if self.anchor not in self.position:
+            self.anchor = None
+        self._show()
+
+    def append_ids(self, ids):
+        for i in ids:
+            self.position[i] = len(self.ids)
+            self.ids.append(i)
+        self._show()
+
+    def remove_ids(self, ids):
+        removed = set(ids)
+        self.selected -= removed
+        self.set_ids([i for i in self.ids if i not in removed])
+
+    def refresh(self, ids=None):
+        # values of ids (all the visible rows by default) changed, only the visible ones are read again
+        shown = self.ids[self.first:self.first + self.rows]
+        if ids is not None:
+            shown = [i for i in ids if self.first <= self.position.get(i, -1) < self.first + self.rows]
+        for i, values in zip(shown, self.values_of(shown)):
+            self.tree.item(str(i), values=values)
+
+    def sort(self, column):
+        # heading click, sort by the column, clicking it again reverses the order
+        if self.sorter is None:
+            return
+        self.descending = not self.descending if column == self.sort_column else False
+        self.sort_column = column
+        self.set_ids(self.sorter(column, self.descending))
+
+    # ============
+    #  selection
+    # ============
+    def selection(self):
+        # selected ids (str like Treeview iid) in display order
+        return tuple(str(i) for i in sorted(self.selected, key=self.position.get))
+
+    def selection_set(self, iids):
+        if isinstance(iids, str):
+            iids = [iids]
+        self.selected = {int(iid) for iid in iids} & set(self.position)
+        if self.selected:
+            self.anchor = min(self.selected, key=self.position.get)
+            self.see(str(self.anchor))
+        else:
+            self._show()
+
+    def see(self, iid):
+        index = self.position[int(iid)]
+        if index < self.first:
+            self.first = index
+        elif index >= self.first + self.rows:
+            self.first = index - self.rows + 1
+        self._show()
+
+    def _select(self, i, toggle=False, extend=False):
+        if extend and self.anchor is not None:
+            st, ed = sorted([self.position[self.anchor], self.position[i]])
+            self.selected = set(self.ids[st:ed + 1])
+        elif toggle:
+            self.selected ^= {i}
+            self.anchor = i
+        else:
+            self.selected = {i}
+            self.anchor = i
+        self.see(str(i))
+
+    def _on_click(self, event, toggle=False, extend=False):
+        if self.tree.identify_region(event.x, event.y) != 'cell':
+            return  # headings and column separators as Treeview
+        iid = self.tree.identify_row(event.y)
+        self.tree.focus_set()
+        if iid:
+            self._select(int(iid), toggle, extend)
+        return 'break'
+
+    def _on_key(self, step, extend=False):
+        if self.ids:
+            if not self.selected:
+                index = 0
+            elif extend:
+                # move the far end of the selection from the anchor
+                positions = [self.position[i] for i in self.selected]
+                index = (max(positions) if step > 0 else min(positions)) + step
+            else:
+                current = self.anchor if self.anchor in self.position else min(self.selected, key=self.position.get)
+                index = self.position[current] + step
+            self._select(self.ids[min(max(0, index), len(self.ids) - 1)], extend=extend)
+        return 'break'
+
+    # ============
+    #  scrolling
+    # ============
+    def yview(self, *args):
+        # scrollbar command, ('moveto', fraction) or ('scroll', number, 'units' / 'pages')
+        if args[0] == 'moveto':
+            self.first = int(float(args[1]) * len(self.ids))
+        elif args[0] == 'scroll':
+            step = int(args[1]) * (self.rows if args[2] == 'pages' else 1)
+            self.first += step
+        self._show()
+
+    def _on_wheel(self, step):
+        self.yview('scroll', step * 3, 'units')
+        return 'break'
+
+    def _on_resize(self, event):
+        # rows fitting under the heading
+        rows = max(1, event.height // self.row_height - 1)
+        if rows != self.rows:
+            self.rows = rows
+            self._show()
+
+    def _show(self):
+        # materialize the visible rows only
+        self.first = min(max(0, self.first), max(0, len(self.ids) - self.rows))
+        shown = self.ids[self.first:self.first + self.rows]
+        self.tree.delete(*self.tree.get_children())
+        for i, values in zip(shown, self.values_of(shown)):
+            self.tree.insert('', 'end', iid=str(i), values=values)
+        self.tree.selection_set([str(i) for i in shown if i in self.selected])
+        if self.ids:
+            self.bar.set(self.first / len(self.ids), (self.first + len(shown)) / len(self.ids))
+        else:
+            self.bar.set(0, 1)